@@ -0,0 +1,59 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+TOKEN_KEY = 'auth-token:{0}'
+
+
+def get_token_cache_key(key):
+    return TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def evict_token(key):
+    cache.delete(get_token_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def count(cls, hit):
+        with cls.lock:
+            if hit:
+                cls.hits += 1
+            else:
+                cls.misses += 1
+
+    @classmethod
+    def stats(cls):
+        return {'hits': cls.hits, 'misses': cls.misses}
+
+    def authenticate(self, request):
+        # Middleware may need the user before the view does; the outcome
+        # is kept on the Django request so a request looks its token up
+        # (and counts it) once.
+        http_request = getattr(request, '_request', request)
+        if not hasattr(http_request, 'token_credentials'):
+            try:
+                http_request.token_credentials = super().authenticate(
+                    request)
+            except AuthenticationFailed as error:
+                http_request.token_credentials = error
+        if isinstance(http_request.token_credentials, AuthenticationFailed):
+            raise http_request.token_credentials
+        return http_request.token_credentials
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        credentials = cache.get(cache_key)
+        self.count(credentials is not None)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            cache.set(cache_key, credentials, settings.AUTH_TOKEN_CACHE_TTL)
+        return credentials
@@ -0,0 +1,65 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+
+class IngredientIndex:
+    # Casefolded names are kept sorted, so prefix matches are a bisect
+    # plus a short scan. The TTL also picks up bulk imports that bypass
+    # the invalidation signals.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if (snapshot is not None
+                and time.monotonic() - snapshot[0]
+                < settings.INGREDIENT_INDEX_TTL):
+            return snapshot
+        with self._lock:
+            if self._snapshot is not snapshot:
+                return self._snapshot
+            ingredients = Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )[:settings.INGREDIENT_INDEX_MAX_SIZE + 1]
+            entries = sorted(
+                (name.casefold(), pk, name, measurement_unit)
+                for pk, name, measurement_unit in ingredients
+            )
+            if len(entries) > settings.INGREDIENT_INDEX_MAX_SIZE:
+                entries = None
+            keys = entries and [entry[0] for entry in entries]
+            self._snapshot = (time.monotonic(), entries, keys)
+            return self._snapshot
+
+    def search(self, query, limit):
+        _, entries, keys = self._get_snapshot()
+        if entries is None:
+            return None
+        query = query.casefold()
+        found = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(entries[position])
+            position += 1
+        if len(found) < limit:
+            for entry in entries:
+                if query in entry[0] and not entry[0].startswith(query):
+                    found.append(entry)
+                    if len(found) >= limit:
+                        break
+        return [{'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, pk, name, unit in found]
+
+
+ingredient_index = IngredientIndex()
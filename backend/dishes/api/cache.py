@@ -0,0 +1,104 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+VERSION_KEY = 'version:{0}'
+RESPONSE_KEY = 'response:{0}'
+
+
+def get_version(namespace):
+    key = VERSION_KEY.format(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, (uuid.uuid4().hex, int(time.time())), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    cache.set(VERSION_KEY.format(namespace),
+              (uuid.uuid4().hex, int(time.time())), None)
+
+
+def make_key(request, *parts):
+    query = sorted(
+        (key, value) for key, values in request.query_params.lists()
+        for value in values
+    )
+    raw = '|'.join([request.path, repr(query)] + [str(p) for p in parts])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = '"{0}"'.format(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def conditional_response(request, etag, last_modified):
+    not_modified = get_conditional_response(
+        request, etag='"{0}"'.format(etag), last_modified=last_modified)
+    if not_modified is not None:
+        set_validators(not_modified, etag, last_modified)
+    return not_modified
+
+
+def cached_response(method):
+    # Keys carry the version of the view's cache_namespace. Signals bump
+    # it, so stale entries are never read again and simply expire.
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        version, last_modified = get_version(self.cache_namespace)
+        etag = make_key(request, self.cache_namespace, version)
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        key = RESPONSE_KEY.format(etag)
+        data = cache.get(key)
+        if data is None:
+            response = method(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data)
+        else:
+            response = Response(data)
+        return set_validators(response, etag, last_modified)
+    return wrapper
+
+
+def stamp_validators(request, stamps, namespace=None):
+    parts = [request.user.pk, *stamps]
+    last_modified = max(int(stamp.timestamp()) for stamp in stamps)
+    if namespace is not None:
+        version, changed = get_version(namespace)
+        parts.append(version)
+        last_modified = max(last_modified, changed)
+    return make_key(request, *parts), last_modified
+
+
+def stamped_response(method):
+    # Validators come from change stamps (see recipes.stamps) returned by
+    # the view's get_stamps, so a matching request costs a single query.
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        stamps = self.get_stamps()
+        if stamps is None:
+            return method(self, request, *args, **kwargs)
+        etag, last_modified = stamp_validators(
+            request, stamps, self.stamp_namespace)
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = method(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            set_validators(response, etag, last_modified)
+        patch_vary_headers(response, ('Authorization', ))
+        return response
+    return wrapper
@@ -1,14 +1,21 @@
+from django.db.models import Exists, OuterRef
 from rest_framework import filters
 
-from recipes.models import Favorite, ShopItem
+from recipes.models import Favorite, Recipe, ShopItem
+from recipes.search import search_recipes
 
 
-class SearchIngredientByName(filters.BaseFilterBackend):
-    def filter_queryset(self, request, queryset, view):
-        name = request.query_params.get('name')
-        if name:
-            queryset = queryset.filter(name__startswith=name)
-        return queryset
+class SearchIngredientByName:
+    def search(self, queryset, name, limit):
+        # Prefix matches use the UPPER(name) text_pattern_ops index; the
+        # unindexed substring scan only runs when they do not fill the page.
+        found = list(queryset.filter(
+            name__istartswith=name).order_by('name')[:limit])
+        if len(found) < limit:
+            found += queryset.filter(name__icontains=name).exclude(
+                pk__in=[ingredient.pk for ingredient in found]
+            ).order_by('name')[:limit - len(found)]
+        return found
 
 
 class FilterRecipe(filters.BaseFilterBackend):
@@ -17,6 +24,8 @@ class FilterRecipe(filters.BaseFilterBackend):
         is_shoplist = request.query_params.get('is_in_shopping_cart')
         author_id = request.query_params.get('author')
         tags = request.query_params.getlist('tags')
+        ordering = request.query_params.get('ordering')
+        search = request.query_params.get('search', '').strip()
         if is_favorited:
             queryset = queryset.filter(
                 id__in=Favorite.objects.filter(
@@ -29,7 +38,19 @@ class FilterRecipe(filters.BaseFilterBackend):
             queryset = queryset.filter(
                 author=author_id)
         if tags:
-            queryset = queryset.filter(
-                tags__slug__in=tags
-            ).distinct()
+            tag_links = Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'))
+            if request.query_params.get('tags_mode') == 'all':
+                for slug in set(tags):
+                    queryset = queryset.filter(
+                        Exists(tag_links.filter(tag__slug=slug)))
+            else:
+                queryset = queryset.filter(
+                    Exists(tag_links.filter(tag__slug__in=tags)))
+        if search:
+            queryset = search_recipes(queryset, search)
+        if ordering == 'popular':
+            queryset = queryset.order_by('-favorites_count', '-pub_date')
+        elif search:
+            queryset = queryset.order_by('-search_rank', '-pub_date')
         return queryset
@@ -0,0 +1,430 @@
+import json
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.renderers import FastJSONRenderer
+from api.representations import recipe_rows, represent_recipes
+from api.serializers import RecipeSerializer
+
+from recipes.management.commands.import_ingredients import DEFAULT_PATH
+from recipes.models import (Favorite, Follow, Ingredient, IngredientAmount,
+                            Recipe, ShopItem, Tag)
+
+User = get_user_model()
+
+SEED = {
+    'users': 200,
+    'recipes': 2000,
+    'follows': 2000,
+    'favorites': 6000,
+    'cart': 3000,
+    'seed': 17,
+}
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAf'
+         'FcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==')
+
+# Upper bound of database queries per request for every route.
+QUERY_BUDGETS = {
+    'recipes_list': 4,
+    'recipes_list_author': 4,
+    'recipes_list_tags': 4,
+    'recipes_list_tags_all': 4,
+    'recipes_list_favorited': 4,
+    'recipes_list_shopping_cart': 4,
+    'recipes_list_popular': 4,
+    'recipes_list_search': 4,
+    'recipes_list_cursor': 3,
+    'recipes_list_not_modified': 1,
+    'recipe_detail': 3,
+    'recipe_detail_not_modified': 1,
+    'recipe_create': 16,
+    'recipe_patch': 20,
+    'recipe_delete': 14,
+    'favorite_add': 5,
+    'favorite_remove': 4,
+    'shopping_cart_add': 6,
+    'shopping_cart_remove': 6,
+    'shopping_cart_bulk_add': 6,
+    'shopping_cart_bulk_remove': 6,
+    'subscribe': 6,
+    'unsubscribe': 4,
+    'subscriptions': 5,
+    'subscriptions_not_modified': 1,
+    'users_list': 4,
+    'user_detail': 3,
+    'users_me': 2,
+    'tags_list': 1,
+    'tag_detail': 1,
+    'ingredients_search': 1,
+    'ingredient_detail': 1,
+    'download_shopping_cart': 2,
+    'download_not_modified': 1,
+}
+
+
+class Command(BaseCommand):
+    help = ('Seed a fixed dataset in a throwaway test database, benchmark '
+            'every API route and check query budgets and baselines')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', help='Write results to this JSON.')
+        parser.add_argument('--baseline',
+                            help='Compare with results saved earlier.')
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help='Allowed p95 slowdown against the '
+                                 'baseline, 0.5 means +50%%.')
+        parser.add_argument('--route', action='append',
+                            help='Only run these routes.')
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--ingredients-path', default=DEFAULT_PATH)
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with tempfile.TemporaryDirectory() as media_root:
+                # Image variants are rendered off the request path and the
+                # in-memory test database takes no concurrent writers.
+                with override_settings(MEDIA_ROOT=media_root,
+                                       IMAGE_PROCESSING_WORKERS=0):
+                    results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = json.dumps({'routes': results,
+                             'serialization': self.serialization},
+                            indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report + '\n')
+        self.print_table(results)
+        self.stdout.write(
+            'recipe page of {page}: serializer {serializer_cpu_ms:.2f} ms, '
+            'fast path {fast_cpu_ms:.2f} ms CPU'.format(**self.serialization))
+        failures = self.compare(results, (baseline or {}).get('routes'),
+                                options['threshold'])
+        if not self.serialization['identical']:
+            failures.append('recipe list: fast path output differs from '
+                            'RecipeSerializer')
+        if failures:
+            raise CommandError('Benchmark failed:\n' + '\n'.join(failures))
+
+    def run(self, options):
+        if not Recipe.objects.exists():
+            call_command('seed_scale_data', stdout=StringIO(),
+                         ingredients_path=options['ingredients_path'],
+                         **SEED)
+        cache.clear()
+        user = Favorite.objects.values('user').annotate(
+            total=Count('id')).order_by('-total', 'user')[0]['user']
+        self.client = APIClient()
+        token, _ = Token.objects.get_or_create(user_id=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.user = user
+        self.serialization = self.compare_serializers(
+            User.objects.get(pk=user), options['iterations'])
+        results = {}
+        for name, request, setup in self.routes():
+            if options['route'] and name not in options['route']:
+                continue
+            results[name] = self.measure(request, setup,
+                                         options['iterations'])
+        return results
+
+    def routes(self):
+        recipe = Recipe.objects.exclude(author=self.user).order_by('id')
+        other = recipe.values_list('id', flat=True)
+        author = Recipe.objects.values('author').annotate(
+            total=Count('id')).order_by('-total', 'author')[0]['author']
+        followed = set(Follow.objects.filter(
+            follower=self.user).values_list('following', flat=True))
+        stranger = Recipe.objects.exclude(author__in=followed).exclude(
+            author=self.user).values_list('author', flat=True).first()
+        fresh = Recipe.objects.exclude(
+            favorite__user=self.user).exclude(
+            shopitem__user=self.user).exclude(
+            author=self.user).values_list('id', flat=True).first()
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        ingredients = list(Ingredient.objects.values_list('id', flat=True)[:8])
+        word = IngredientAmount.objects.values_list(
+            'ingredient__name', flat=True).first().split()[0]
+        body = {
+            'tags': list(Tag.objects.values_list('id', flat=True)[:2]),
+            'name': 'Benchmark recipe',
+            'image': IMAGE,
+            'text': 'Benchmark recipe text',
+            'cooking_time': 10,
+            'ingredients': [{'id': pk, 'amount': 10} for pk in ingredients],
+        }
+        patch = dict(body, ingredients=[
+            {'id': pk, 'amount': 20} for pk in ingredients[2:]])
+        client = self.client
+        created = []
+        own = Recipe.objects.filter(author=self.user).first()
+        if own is None:
+            own = Recipe.objects.get(pk=self.call(lambda: client.post(
+                '/api/recipes/', body, format='json')).data['id'])
+
+        def create_recipe():
+            created.append(client.post(
+                '/api/recipes/', body, format='json').data['id'])
+
+        def remove_favorite():
+            Favorite.objects.filter(user=self.user, recipe=fresh).delete()
+
+        def add_favorite():
+            Favorite.objects.get_or_create(user_id=self.user, recipe_id=fresh)
+
+        def remove_cart():
+            ShopItem.objects.filter(user=self.user, recipe=fresh).delete()
+
+        def add_cart():
+            ShopItem.objects.get_or_create(user_id=self.user, recipe_id=fresh)
+
+        plan = list(other[:20])
+
+        def clear_plan():
+            ShopItem.objects.filter(user=self.user, recipe__in=plan).delete()
+
+        def fill_plan():
+            ShopItem.objects.bulk_create(
+                [ShopItem(user_id=self.user, recipe_id=pk) for pk in plan],
+                ignore_conflicts=True)
+
+        def unfollow():
+            Follow.objects.filter(follower=self.user,
+                                  following=stranger).delete()
+
+        def follow():
+            Follow.objects.get_or_create(follower_id=self.user,
+                                         following_id=stranger)
+
+        def get(url):
+            return lambda: client.get(url)
+
+        etags = {}
+
+        def revalidate(url):
+            def request():
+                response = client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                if response.status_code != 304:
+                    raise CommandError('{0} was not revalidated ({1})'.format(
+                        url, response.status_code))
+                return response
+
+            def setup():
+                etags[url] = self.call(get(url))['ETag']
+            return request, setup
+
+        tag_query = '&'.join('tags=' + slug for slug in tags)
+        return (
+            ('recipes_list', get('/api/recipes/'), None),
+            ('recipes_list_author',
+             get('/api/recipes/?author={0}'.format(author)), None),
+            ('recipes_list_tags', get('/api/recipes/?' + tag_query), None),
+            ('recipes_list_tags_all',
+             get('/api/recipes/?tags_mode=all&' + tag_query), None),
+            ('recipes_list_favorited',
+             get('/api/recipes/?is_favorited=1'), None),
+            ('recipes_list_shopping_cart',
+             get('/api/recipes/?is_in_shopping_cart=1'), None),
+            ('recipes_list_popular',
+             get('/api/recipes/?ordering=popular'), None),
+            ('recipes_list_search',
+             get('/api/recipes/?' + urlencode({'search': word})), None),
+            ('recipes_list_cursor',
+             get('/api/recipes/?cursor=&count=false'), None),
+            ('recipes_list_not_modified', *revalidate('/api/recipes/')),
+            ('recipe_detail', get('/api/recipes/{0}/'.format(other[0])),
+             None),
+            ('recipe_detail_not_modified',
+             *revalidate('/api/recipes/{0}/'.format(other[0]))),
+            ('recipe_create',
+             lambda: client.post('/api/recipes/', body, format='json'),
+             None),
+            ('recipe_patch',
+             lambda: client.patch('/api/recipes/{0}/'.format(own.id),
+                                  patch, format='json'),
+             lambda: client.patch('/api/recipes/{0}/'.format(own.id),
+                                  body, format='json')),
+            ('recipe_delete',
+             lambda: client.delete(
+                 '/api/recipes/{0}/'.format(created.pop())),
+             create_recipe),
+            ('favorite_add',
+             lambda: client.post('/api/recipes/{0}/favorite/'.format(fresh)),
+             remove_favorite),
+            ('favorite_remove',
+             lambda: client.delete(
+                 '/api/recipes/{0}/favorite/'.format(fresh)),
+             add_favorite),
+            ('shopping_cart_add',
+             lambda: client.post(
+                 '/api/recipes/{0}/shopping_cart/'.format(fresh)),
+             remove_cart),
+            ('shopping_cart_remove',
+             lambda: client.delete(
+                 '/api/recipes/{0}/shopping_cart/'.format(fresh)),
+             add_cart),
+            ('shopping_cart_bulk_add',
+             lambda: client.post('/api/recipes/shopping_cart/',
+                                 {'ids': plan}, format='json'),
+             clear_plan),
+            ('shopping_cart_bulk_remove',
+             lambda: client.delete('/api/recipes/shopping_cart/',
+                                   {'ids': plan}, format='json'),
+             fill_plan),
+            ('subscribe',
+             lambda: client.post(
+                 '/api/users/{0}/subscribe/'.format(stranger)),
+             unfollow),
+            ('unsubscribe',
+             lambda: client.delete(
+                 '/api/users/{0}/subscribe/'.format(stranger)),
+             follow),
+            ('subscriptions',
+             get('/api/users/subscriptions/?recipes_limit=3'), None),
+            ('subscriptions_not_modified',
+             *revalidate('/api/users/subscriptions/?recipes_limit=3')),
+            ('users_list', get('/api/users/'), None),
+            ('user_detail', get('/api/users/{0}/'.format(author)), None),
+            ('users_me', get('/api/users/me/'), None),
+            ('tags_list', get('/api/tags/'), None),
+            ('tag_detail', get('/api/tags/{0}/'.format(body['tags'][0])),
+             None),
+            ('ingredients_search', get('/api/ingredients/?name=сы'), None),
+            ('ingredient_detail',
+             get('/api/ingredients/{0}/'.format(ingredients[0])), None),
+            ('download_shopping_cart',
+             get('/api/recipes/download_shopping_cart/'), None),
+            ('download_not_modified',
+             *revalidate('/api/recipes/download_shopping_cart/')),
+        )
+
+    @staticmethod
+    def compare_serializers(user, iterations, page=100):
+        Recipe.objects.filter(pk=Recipe.objects.values('pk')[:1]).update(
+            text='Line\u2028separators\u2029and "quotes" </script>')
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        identical = True
+        timings = {'serializer': [], 'fast': []}
+        for viewer in (user, AnonymousUser()):
+            request.user = viewer
+            for _ in range(iterations):
+                started = time.process_time()
+                recipes = Recipe.objects.for_display().with_viewer_flags(
+                    viewer)[:page]
+                expected = JSONRenderer().render(RecipeSerializer(
+                    recipes, many=True, context={'request': request}).data)
+                timings['serializer'].append(time.process_time() - started)
+                started = time.process_time()
+                rows = list(recipe_rows(
+                    Recipe.objects.with_viewer_flags(viewer))[:page])
+                actual = FastJSONRenderer().render(represent_recipes(rows))
+                timings['fast'].append(time.process_time() - started)
+                identical = identical and actual == expected
+        return {
+            'page': page,
+            'identical': identical,
+            'serializer_cpu_ms': round(
+                sorted(timings['serializer'])[len(timings['serializer']) // 2]
+                * 1000, 3),
+            'fast_cpu_ms': round(
+                sorted(timings['fast'])[len(timings['fast']) // 2] * 1000, 3),
+        }
+
+    def call(self, request):
+        response = request()
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            raise CommandError('{0} {1}'.format(
+                response.status_code, getattr(response, 'data', '')))
+        return response
+
+    def measure(self, request, setup, iterations):
+        if setup:
+            setup()
+        self.call(request)
+        timings = []
+        queries = 0
+        for _ in range(iterations):
+            if setup:
+                setup()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                self.call(request)
+                timings.append(time.perf_counter() - started)
+            queries = max(queries, len(context))
+        if setup:
+            setup()
+        tracemalloc.start()
+        self.call(request)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        timings.sort()
+        return {
+            'p50_ms': round(timings[len(timings) // 2] * 1000, 3),
+            'p95_ms': round(
+                timings[min(len(timings) - 1,
+                            int(len(timings) * 0.95))] * 1000, 3),
+            'queries': queries,
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def print_table(self, results):
+        self.stdout.write('{0:28} {1:>9} {2:>9} {3:>8} {4:>10}'.format(
+            'route', 'p50 ms', 'p95 ms', 'queries', 'memory kb'))
+        for name, result in results.items():
+            self.stdout.write(
+                '{0:28} {1:9.2f} {2:9.2f} {3:8d} {4:10.1f}'.format(
+                    name, result['p50_ms'], result['p95_ms'],
+                    result['queries'], result['peak_memory_kb']))
+
+    @staticmethod
+    def compare(results, baseline, threshold):
+        failures = []
+        for name, result in results.items():
+            budget = QUERY_BUDGETS.get(name)
+            if budget is not None and result['queries'] > budget:
+                failures.append('{0}: {1} queries, budget is {2}'.format(
+                    name, result['queries'], budget))
+            previous = (baseline or {}).get(name)
+            if not previous:
+                continue
+            if result['queries'] > previous['queries']:
+                failures.append('{0}: {1} queries, baseline was {2}'.format(
+                    name, result['queries'], previous['queries']))
+            limit = previous['p95_ms'] * (1 + threshold)
+            if result['p95_ms'] > limit:
+                failures.append(
+                    '{0}: p95 {1:.2f} ms, baseline was {2:.2f} ms'.format(
+                        name, result['p95_ms'], previous['p95_ms']))
+        return failures
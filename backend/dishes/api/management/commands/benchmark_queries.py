@@ -0,0 +1,275 @@
+import json
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.autocomplete import ingredient_index
+from api.filters import FilterRecipe, SearchIngredientByName
+from api.pagination import LimitPageNumberPagination
+from api.serializers import IngredientSerializer
+from api.shopping_cart import RENDERERS, get_shopping_list
+
+from recipes.management.commands.import_ingredients import DEFAULT_PATH
+from recipes.models import (Ingredient, IngredientAmount, Recipe, ShopItem,
+                            Tag)
+from recipes.shopping_lists import rebuild
+
+User = get_user_model()
+
+# case: seed_scale_data options it runs on
+CASES = {
+    'pagination': {
+        'users': 1000, 'recipes': 110000, 'follows': 0, 'favorites': 0,
+        'cart': 0, 'tags_per_recipe': 1, 'ingredients_per_recipe': 1,
+    },
+    'tags': {
+        'users': 1000, 'recipes': 1000000, 'follows': 0, 'favorites': 0,
+        'cart': 0, 'tags': 20, 'tags_per_recipe': 5,
+        'ingredients_per_recipe': 1,
+    },
+    'ingredient_search': {
+        'users': 2, 'recipes': 1, 'follows': 0, 'favorites': 0, 'cart': 0,
+        'tags_per_recipe': 1, 'ingredients_per_recipe': 1,
+    },
+    'shopping_cart': {
+        'users': 2, 'recipes': 1000, 'follows': 0, 'favorites': 0,
+        'cart': 0, 'tags_per_recipe': 1, 'ingredients_per_recipe': 20,
+    },
+}
+
+
+def old_shopping_list(user):
+    # download_shopping_cart before the shopping list table: every cart
+    # ingredient row loaded and summed in Python into one string.
+    ingredients = IngredientAmount.objects.filter(
+        recipe__in=Recipe.objects.filter(
+            id__in=ShopItem.objects.filter(user=user).values('recipe'))
+    ).prefetch_related('ingredient')
+    name_amount = dict()
+    name_unit = dict()
+    for ing in ingredients:
+        name = ing.ingredient.name
+        if name in name_amount:
+            name_amount[name] += ing.amount
+        else:
+            name_amount[name] = ing.amount
+        name_unit[name] = ing.ingredient.measurement_unit
+    result = str()
+    for name, amount in name_amount.items():
+        result += name + ': ' + str(amount) + ' ' + name_unit[name] + '\n'
+    return result
+
+
+def totals(text):
+    amounts = {}
+    for line in text.splitlines():
+        name, rest = line.split(': ', 1)
+        amounts[name] = amounts.get(name, 0) + int(rest.split(' ', 1)[0])
+    return amounts
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database and time the previous and the '
+            'current implementation of one query side by side')
+
+    def add_arguments(self, parser):
+        parser.add_argument('case', choices=sorted(CASES))
+        parser.add_argument('--recipes', type=int,
+                            help='Recipes to seed, the case default if '
+                                 'omitted.')
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--output', help='Write results to this JSON.')
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--ingredients-path', default=DEFAULT_PATH)
+
+    def handle(self, *args, **options):
+        case = options['case']
+        seed = dict(CASES[case], seed=17)
+        if options['recipes']:
+            seed['recipes'] = options['recipes']
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            if not Recipe.objects.exists():
+                call_command('seed_scale_data', stdout=StringIO(),
+                             ingredients_path=options['ingredients_path'],
+                             **seed)
+            cache.clear()
+            self.iterations = options['iterations']
+            rows = getattr(self, case)()
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'case': case, 'seed': seed, 'results': rows},
+                          file, indent=2)
+                file.write('\n')
+        self.print_table(rows)
+
+    def measure(self, function):
+        function()
+        timings = []
+        for _ in range(self.iterations):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return round(timings[len(timings) // 2] * 1000, 2)
+
+    def print_table(self, rows):
+        columns = list(rows[0])
+        self.stdout.write(' '.join('{0:>14}'.format(column)
+                                   for column in columns))
+        for row in rows:
+            self.stdout.write(' '.join('{0:>14}'.format(row[column])
+                                       for column in columns))
+
+    def pagination(self):
+        # The same ten recipes reached with ?page= (OFFSET plus COUNT) and
+        # with a cursor (keyset on -pub_date, -id and no COUNT).
+        client = APIClient()
+        ordered = Recipe.objects.order_by('-pub_date', '-id')
+        total = ordered.count()
+        paginator = LimitPageNumberPagination()
+        rows = []
+        for offset in (0, 1000, 10000, 100000):
+            if offset >= total:
+                break
+            cursor = ''
+            if offset:
+                previous = ordered.values('pub_date', 'id')[offset - 1]
+                cursor = paginator.encode_cursor(
+                    [previous['pub_date'], previous['id']], False)
+            page_url = '/api/recipes/?limit=10&page={0}'.format(
+                offset // 10 + 1)
+            cursor_url = '/api/recipes/?limit=10&count=false&cursor=' + cursor
+
+            def get(url):
+                cache.clear()
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError('{0}: {1}'.format(
+                        url, response.status_code))
+                return [recipe['id'] for recipe in response.data['results']]
+
+            if get(page_url) != get(cursor_url):
+                raise CommandError(
+                    'Page and cursor disagree at offset {0}.'.format(offset))
+            rows.append({
+                'offset': offset,
+                'page_ms': self.measure(lambda: get(page_url)),
+                'cursor_ms': self.measure(lambda: get(cursor_url)),
+            })
+        return rows
+
+    def tags(self):
+        # The first page and the count of /api/recipes/?tags=..., filtered
+        # the old way (a join per tag plus DISTINCT) and through FilterRecipe
+        # (EXISTS over the link table).
+        slugs = list(Tag.objects.order_by('id').values_list('slug', flat=True))
+        rows = []
+        for picked in ([slugs[0]], slugs[:3], [slugs[0], slugs[-1]]):
+            query = '&'.join('tags=' + slug for slug in picked)
+            old_any = Recipe.objects.filter(tags__slug__in=picked).distinct()
+            old_all = Recipe.objects.all()
+            for slug in picked:
+                old_all = old_all.filter(tags__slug=slug)
+            for mode, old in (('any', old_any), ('all', old_all.distinct())):
+                request = Request(APIRequestFactory().get(
+                    '/api/recipes/?tags_mode={0}&{1}'.format(mode, query)))
+                new = FilterRecipe().filter_queryset(
+                    request, Recipe.objects.all(), None)
+
+                def page(queryset):
+                    return queryset.count(), list(queryset.order_by(
+                        '-pub_date', '-id').values_list('id', flat=True)[:10])
+
+                if page(old) != page(new):
+                    raise CommandError('Filters disagree for {0} {1}.'.format(
+                        mode, query))
+                rows.append({
+                    'tags': ','.join(picked),
+                    'mode': mode,
+                    'matches': page(new)[0],
+                    'old_ms': self.measure(lambda: page(old)),
+                    'new_ms': self.measure(lambda: page(new)),
+                })
+        return rows
+
+    def shopping_cart(self):
+        # One user with every seeded recipe in the cart.
+        user = User.objects.order_by('id').first()
+        ShopItem.objects.filter(user=user).delete()
+        ShopItem.objects.bulk_create(
+            [ShopItem(user=user, recipe_id=recipe_id) for recipe_id in
+             Recipe.objects.values_list('id', flat=True)])
+        rebuild([user.pk])
+        cart_rows = IngredientAmount.objects.filter(
+            recipe__in=ShopItem.objects.filter(user=user).values('recipe')
+        ).count()
+
+        def new(file_format):
+            return ''.join(RENDERERS[file_format](
+                get_shopping_list(user).iterator()))
+
+        # The old code merged one name in different units into a single
+        # line, so only the per-name totals can be compared.
+        if totals(old_shopping_list(user)) != totals(new('txt')):
+            raise CommandError('Shopping lists disagree.')
+        old_ms = self.measure(lambda: old_shopping_list(user))
+        return [{
+            'format': file_format,
+            'cart_rows': cart_rows,
+            'old_txt_ms': old_ms,
+            'new_ms': self.measure(lambda: new(file_format)),
+        } for file_format in RENDERERS]
+
+    def ingredient_search(self):
+        # Autocomplete over the imported ingredients: the old unlimited
+        # case-sensitive startswith list, the database fallback and the
+        # in-memory index, per query.
+        names = list(Ingredient.objects.order_by('id').values_list(
+            'name', flat=True))
+        limit = settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        searcher = SearchIngredientByName()
+        ingredient_index.invalidate()
+        rows = []
+        for label, cut in (('prefix 1', slice(0, 1)),
+                           ('prefix 3', slice(0, 3)),
+                           ('prefix 5', slice(0, 5)),
+                           ('substring 3', slice(2, 5))):
+            queries = sorted({name[cut] for name in names[::20]
+                              if len(name[cut]) == cut.stop - cut.start})
+
+            def run(search):
+                return lambda: [search(query) for query in queries]
+
+            timings = {
+                'old_ms': run(lambda query: IngredientSerializer(
+                    Ingredient.objects.filter(name__startswith=query),
+                    many=True).data),
+                'db_ms': run(lambda query: IngredientSerializer(
+                    searcher.search(Ingredient.objects.all(), query, limit),
+                    many=True).data),
+                'index_ms': run(lambda query: ingredient_index.search(
+                    query, limit)),
+            }
+            row = {'query': label, 'queries': len(queries)}
+            for column, function in timings.items():
+                row[column] = round(
+                    self.measure(function) / len(queries), 3)
+            rows.append(row)
+        return rows
@@ -0,0 +1,50 @@
+import pstats
+from collections import defaultdict
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from api.profiling import get_profile_view, list_profiles
+
+
+class Command(BaseCommand):
+    help = 'List recent request profiles and their top functions per view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20,
+                            help='How many recent profiles to use.')
+        parser.add_argument('--top', type=int, default=10,
+                            help='How many functions to show per view.')
+        parser.add_argument('--view', help='Only show this view.')
+        parser.add_argument('--sort', choices=('tottime', 'cumtime'),
+                            default='tottime')
+
+    def handle(self, *args, **options):
+        profiles = [profile for profile in list_profiles()
+                    if options['view'] in (None, get_profile_view(profile))]
+        profiles = profiles[:options['limit']]
+        if not profiles:
+            self.stdout.write('No profiles found.')
+            return
+        by_view = defaultdict(list)
+        self.stdout.write('Recent profiles:')
+        for profile in profiles:
+            self.stdout.write('  {0}  {1}'.format(
+                datetime.fromtimestamp(profile.stat().st_mtime)
+                .strftime('%Y-%m-%d %H:%M:%S'), profile.name))
+            by_view[get_profile_view(profile)].append(str(profile))
+
+        column = 2 if options['sort'] == 'tottime' else 3
+        for view, paths in sorted(by_view.items()):
+            stats = pstats.Stats(*paths)
+            self.stdout.write('\n{0} ({1} profiles, {2:.1f} ms total)'.format(
+                view, len(paths), stats.total_tt * 1000))
+            self.stdout.write('  {0:>13} {1:>13} {2:>8}  function'.format(
+                'tottime', 'cumtime', 'calls'))
+            rows = sorted(stats.stats.items(),
+                          key=lambda item: item[1][column], reverse=True)
+            for (filename, line, name), row in rows[:options['top']]:
+                self.stdout.write(
+                    '  {0:10.2f} ms {1:10.2f} ms {2:8d}  {3}:{4}({5})'.format(
+                        row[2] * 1000, row[3] * 1000, row[1],
+                        filename, line, name))
@@ -0,0 +1,83 @@
+import threading
+from bisect import bisect_left
+
+from api.authentication import CachedTokenAuthentication
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760)
+
+METRICS = (
+    ('request_duration_seconds', 'Wall time per view.', DURATION_BUCKETS),
+    ('db_duration_seconds', 'Database time per view.', DURATION_BUCKETS),
+    ('db_queries', 'Database queries per request.', QUERY_BUCKETS),
+    ('render_duration_seconds', 'Response rendering time per view.',
+     DURATION_BUCKETS),
+    ('response_size_bytes', 'Rendered response size per view.',
+     SIZE_BUCKETS),
+)
+PREFIX = 'dishes_'
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, view, **values):
+        with self.lock:
+            for name, value in values.items():
+                key = (name, view)
+                if key not in self.histograms:
+                    buckets = next(buckets for metric, _, buckets in METRICS
+                                   if metric == name)
+                    self.histograms[key] = Histogram(buckets)
+                self.histograms[key].observe(value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, description, _ in METRICS:
+                lines.append('# HELP {0}{1} {2}'.format(
+                    PREFIX, name, description))
+                lines.append('# TYPE {0}{1} histogram'.format(PREFIX, name))
+                for (metric, view), histogram in sorted(
+                        self.histograms.items()):
+                    if metric == name:
+                        lines.extend(self.render_histogram(
+                            PREFIX + name, view, histogram))
+        for name, value in CachedTokenAuthentication.stats().items():
+            lines.append('# TYPE {0}auth_token_cache_{1}_total counter'
+                         .format(PREFIX, name))
+            lines.append('{0}auth_token_cache_{1}_total {2}'.format(
+                PREFIX, name, value))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def render_histogram(name, view, histogram):
+        label = 'view="{0}"'.format(view.replace('"', '\\"'))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            yield '{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                name, label, bound, cumulative)
+        yield '{0}_bucket{{{1},le="+Inf"}} {2}'.format(
+            name, label, histogram.count)
+        yield '{0}_sum{{{1}}} {2}'.format(name, label, histogram.sum)
+        yield '{0}_count{{{1}}} {2}'.format(name, label, histogram.count)
+
+
+registry = Registry()
@@ -0,0 +1,174 @@
+import cProfile
+import itertools
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.authentication import CachedTokenAuthentication
+from api.metrics import registry
+from api.profiling import save_profile
+from dishes.routers import use_primary
+
+PIN_KEY = 'db-pin:{0}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name or match._func_path
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        action = actions.get(request.method.lower(), request.method.lower())
+        return '{0}.{1}'.format(view_class.__name__, action)
+    return view_class.__name__
+
+
+def get_request_user(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    try:
+        credentials = CachedTokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return credentials[0] if credentials else None
+
+
+def is_staff_request(request):
+    user = get_request_user(request)
+    return user is not None and user.is_staff
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    @staticmethod
+    def instrument(timer):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        return stack
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        request.render_duration = 0
+        started = time.perf_counter()
+        with self.instrument(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        if is_staff_request(request):
+            response['Server-Timing'] = (
+                'total;dur={0:.1f}, db;dur={1:.1f};desc="{2} queries", '
+                'render;dur={3:.1f}'.format(
+                    duration * 1000, timer.duration * 1000, timer.count,
+                    request.render_duration * 1000))
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response.streaming_content, timer, started)
+        else:
+            self.observe(request, timer, duration, len(response.content))
+        return response
+
+    def stream(self, request, content, timer, started):
+        size = 0
+        with self.instrument(timer):
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        self.observe(request, timer, time.perf_counter() - started, size)
+
+    def observe(self, request, timer, duration, size):
+        registry.observe(
+            get_view_name(request),
+            request_duration_seconds=duration,
+            db_duration_seconds=timer.duration,
+            db_queries=timer.count,
+            render_duration_seconds=request.render_duration,
+            response_size_bytes=size,
+        )
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.render_duration = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class ProfilingMiddleware:
+    header = 'X-Profile'
+
+    def __init__(self, get_response):
+        if not (settings.PROFILING_SAMPLE_RATE
+                or settings.PROFILING_HEADER_ENABLED):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.counter = itertools.count(1)
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        save_profile(profiler, get_view_name(request))
+        return response
+
+    def should_profile(self, request):
+        rate = settings.PROFILING_SAMPLE_RATE
+        if rate and next(self.counter) % rate == 0:
+            return True
+        return (settings.PROFILING_HEADER_ENABLED
+                and self.header in request.headers
+                and is_staff_request(request))
+
+
+class ReplicaPinningMiddleware:
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = get_request_user(request)
+        pin_key = PIN_KEY.format(user.pk) if user else None
+        unsafe = request.method not in SAFE_METHODS
+        token = use_primary.set(
+            unsafe or bool(pin_key and cache.get(pin_key)))
+        response = self.get_response(request)
+        if unsafe and pin_key and response.status_code < 400:
+            cache.set(pin_key, True, settings.REPLICA_PIN_SECONDS)
+        if not response.streaming:
+            use_primary.reset(token)
+        return response
@@ -1,6 +1,144 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_by_cursor(queryset, request)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_cursor_link(self.next_position, False)),
+            ('previous', self.get_cursor_link(self.previous_position, True)),
+            ('results', data),
+        ]))
+
+    def paginate_by_cursor(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.count = None
+        if request.query_params.get(self.count_query_param) not in (
+                'false', '0'):
+            self.count = queryset.count()
+
+        cursor = request.query_params[self.cursor_query_param]
+        position, reverse = self.decode_cursor(queryset.model, cursor)
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.reverse_field(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        first = self.get_position(results[0]) if results else None
+        last = self.get_position(results[-1]) if results else None
+        if reverse:
+            self.next_position = last if position is not None else None
+            self.previous_position = first if has_more else None
+        else:
+            self.next_position = last if has_more else None
+            self.previous_position = (first if position is not None
+                                      else None)
+        return results
+
+    def get_ordering(self, queryset):
+        ordering = [
+            field for field in (queryset.query.order_by
+                                or queryset.model._meta.ordering)
+            if isinstance(field, str) and field != '?'
+        ]
+        pk_name = queryset.model._meta.pk.name
+        ordering = [field.replace('pk', pk_name)
+                    if field.lstrip('-') == 'pk' else field
+                    for field in ordering]
+        if not any(field.lstrip('-') == pk_name for field in ordering):
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append('-' + pk_name if descending else pk_name)
+        return ordering
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def after(ordering, position):
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{'{0}__{1}'.format(name, lookup): position[index]})
+            for previous, value in zip(ordering[:index], position):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        # Redundant with the OR above, but it gives the planner a range on
+        # the leading column to seek to instead of scanning from the top.
+        first = ordering[0]
+        bound = Q(**{'{0}__{1}'.format(
+            first.lstrip('-'), 'lte' if first.startswith('-') else 'gte'):
+            position[0]})
+        return bound & condition
+
+    def get_position(self, obj):
+        return [obj[field.lstrip('-')] if isinstance(obj, dict)
+                else getattr(obj, field.lstrip('-'))
+                for field in self.ordering]
+
+    def encode_cursor(self, position, reverse):
+        values = [value.isoformat() if hasattr(value, 'isoformat')
+                  else value for value in position]
+        payload = json.dumps({'p': values, 'r': reverse},
+                             separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, model, cursor):
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = []
+            for field, value in zip(self.ordering, values):
+                try:
+                    value = model._meta.get_field(
+                        field.lstrip('-')).to_python(value)
+                except FieldDoesNotExist:
+                    pass
+                position.append(value)
+            return position, bool(payload['r'])
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_cursor_link(self, position, reverse):
+        if position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(position, reverse))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import MultiPartParser
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Request body is too large.'
+    default_code = 'payload_too_large'
+
+
+class LimitedMultiPartParser(MultiPartParser):
+    # Rejects oversized bodies before anything is streamed to disk; files
+    # themselves go through Django's upload handlers (temp files once they
+    # outgrow FILE_UPLOAD_MAX_MEMORY_SIZE).
+    def parse(self, stream, media_type=None, parser_context=None):
+        meta = parser_context['request'].META
+        try:
+            length = int(meta.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        limit = (settings.RECIPE_IMAGE_MAX_BYTES
+                 + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0))
+        if length > limit:
+            raise PayloadTooLarge()
+        return super().parse(stream, media_type, parser_context)
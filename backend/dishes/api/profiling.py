@@ -0,0 +1,39 @@
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+
+SUFFIX = '.prof'
+
+
+def get_spool_dir():
+    path = Path(settings.PROFILING_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def list_profiles():
+    path = Path(settings.PROFILING_DIR)
+    if not path.is_dir():
+        return []
+    return sorted(path.glob('*' + SUFFIX),
+                  key=lambda profile: profile.stat().st_mtime,
+                  reverse=True)
+
+
+def get_profile_view(profile):
+    return profile.stem.split('-', 2)[-1]
+
+
+def save_profile(profiler, view):
+    name = '{0}-{1}-{2}{3}'.format(
+        datetime.now().strftime('%Y%m%dT%H%M%S%f'), os.getpid(),
+        re.sub(r'[^\w.]+', '_', view), SUFFIX)
+    profiler.dump_stats(str(get_spool_dir() / name))
+    for stale in list_profiles()[settings.PROFILING_MAX_FILES:]:
+        try:
+            stale.unlink()
+        except FileNotFoundError:
+            pass
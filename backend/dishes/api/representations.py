@@ -0,0 +1,109 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.cache import get_version
+from recipes.models import IngredientAmount, Recipe
+
+FRAGMENT_KEY = 'recipe-fragment:{0}:{1}:{2}'
+FRAGMENT_NAMESPACE = 'recipes'
+FRAGMENT_FIELDS = (
+    'id', 'name', 'image', 'display_image', 'text', 'cooking_time',
+    'author_id', 'author__email', 'author__username', 'author__first_name',
+    'author__last_name', 'updated_at',
+)
+PAGE_FIELDS = ('id', 'pub_date', 'updated_at', 'favorites_count')
+image_storage = Recipe._meta.get_field('image').storage
+
+
+def recipe_rows(queryset):
+    return queryset.values(*PAGE_FIELDS, *queryset.query.annotations)
+
+
+def get_fragment_key(recipe_id, version, updated_at):
+    return FRAGMENT_KEY.format(recipe_id, version,
+                               int(updated_at.timestamp() * 1000000))
+
+
+def build_fragments(recipe_ids):
+    tags = defaultdict(list)
+    for recipe_id, tag_id, name, color, slug in (
+            Recipe.tags.through.objects.filter(recipe_id__in=recipe_ids)
+            .order_by('tag_id').values_list(
+                'recipe_id', 'tag_id', 'tag__name', 'tag__color',
+                'tag__slug')):
+        tags[recipe_id].append(
+            {'id': tag_id, 'name': name, 'color': color, 'slug': slug})
+    ingredients = defaultdict(list)
+    for recipe_id, amount, name, ingredient_id, unit in (
+            IngredientAmount.objects.filter(recipe_id__in=recipe_ids)
+            .order_by('id').values_list(
+                'recipe_id', 'amount', 'ingredient__name', 'ingredient_id',
+                'ingredient__measurement_unit')):
+        ingredients[recipe_id].append({
+            'amount': amount, 'name': name, 'id': ingredient_id,
+            'measurement_unit': unit,
+        })
+    return {row['id']: (row['updated_at'], {
+        'id': row['id'],
+        'tags': tags[row['id']],
+        'author': {
+            'id': row['author_id'],
+            'email': row['author__email'],
+            'username': row['author__username'],
+            'first_name': row['author__first_name'],
+            'last_name': row['author__last_name'],
+        },
+        'name': row['name'],
+        'image': image_storage.url(row['display_image'] or row['image']),
+        'text': row['text'],
+        'cooking_time': row['cooking_time'],
+        'ingredients': ingredients[row['id']],
+    }) for row in Recipe.objects.filter(id__in=recipe_ids).values(
+        *FRAGMENT_FIELDS)}
+
+
+def get_fragments(rows):
+    # Fragments hold everything that does not depend on the viewer. They
+    # are keyed by the recipe's updated_at, which every recipe, ingredient,
+    # tag link and author edit moves forward, so a fragment built from
+    # rows read before an edit is stored under a key nobody asks for
+    # again. Tag and ingredient catalog edits bump the version instead.
+    version = get_version(FRAGMENT_NAMESPACE)[0]
+    keys = {get_fragment_key(row['id'], version, row['updated_at']):
+            row['id'] for row in rows}
+    fragments = {keys[key]: fragment
+                 for key, fragment in cache.get_many(keys).items()}
+    missing = [row['id'] for row in rows if row['id'] not in fragments]
+    if missing:
+        built = build_fragments(missing)
+        cache.set_many(
+            {get_fragment_key(pk, version, updated_at): fragment
+             for pk, (updated_at, fragment) in built.items()},
+            settings.RECIPE_FRAGMENT_TTL)
+        fragments.update(
+            (pk, fragment) for pk, (_, fragment) in built.items())
+    return fragments
+
+
+def represent_recipe(fragment, row):
+    return {
+        'id': fragment['id'],
+        'tags': fragment['tags'],
+        'author': dict(fragment['author'],
+                       is_subscribed=row['author_is_subscribed']),
+        'name': fragment['name'],
+        'image': fragment['image'],
+        'text': fragment['text'],
+        'cooking_time': fragment['cooking_time'],
+        'is_favorited': row['is_favorited'],
+        'is_in_shopping_cart': row['is_in_shopping_cart'],
+        'ingredients': fragment['ingredients'],
+    }
+
+
+def represent_recipes(rows):
+    fragments = get_fragments(rows)
+    return [represent_recipe(fragments[row['id']], row) for row in rows
+            if row['id'] in fragments]
@@ -1,14 +1,22 @@
 import base64
+import binascii
+import json
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
 from djoser.serializers import UserSerializer
+from PIL import Image
 from rest_framework import serializers
-from rest_framework.validators import UniqueTogetherValidator
+from rest_framework.utils import html
 
+from recipes.images import reset_variants, schedule_processing
 from recipes.models import (Favorite, Follow, Ingredient, IngredientAmount,
                             Recipe, ShopItem, Tag)
+from recipes.search import update_index as update_search_index
+from recipes.shopping_lists import batch_ingredients
+from recipes.stamps import touch_carts
 
 User = get_user_model()
 
@@ -22,6 +30,9 @@ class DjoserUserSerializer(UserSerializer):
                   'is_subscribed', )
 
     def get_is_subscribed(self, obj):
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request_user = self.context['request'].user.pk
         return Follow.objects.filter(
             follower=request_user, following=obj).exists()
@@ -64,7 +75,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     author = DjoserUserSerializer()
     ingredients = IngredientAmountSerializer(many=True)
-    image = serializers.ReadOnlyField(source='image.url')
+    image = serializers.ReadOnlyField(source='display_url')
 
     class Meta:
         model = Recipe
@@ -72,12 +83,24 @@ class RecipeSerializer(serializers.ModelSerializer):
                   'cooking_time', 'is_favorited', 'is_in_shopping_cart',
                   'ingredients', )
 
+    def to_representation(self, instance):
+        is_subscribed = getattr(instance, 'author_is_subscribed', None)
+        if is_subscribed is not None:
+            instance.author.is_subscribed = is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
         request_user = self.context['request'].user.pk
         return Favorite.objects.filter(
             user=request_user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         request_user = self.context['request'].user.pk
         return ShopItem.objects.filter(
             user=request_user, recipe=obj).exists()
@@ -92,14 +115,60 @@ class IngredientAmountCreateSerializer(serializers.ModelSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
+    # Four base64 characters decode into three bytes.
+    chunk_size = 4 * 65536
+    default_error_messages = {
+        'invalid_base64': 'Image is not valid base64.',
+        'too_large': 'Image is larger than {max_bytes} bytes.',
+        'too_many_pixels': 'Image is larger than {max_pixels} pixels.',
+    }
+
+    def decode(self, data):
+        format, separator, imgstr = data.partition(';base64,')
+        if not separator:
+            self.fail('invalid_base64')
+        ext = format.split('/')[-1]
+        if len(imgstr) * 3 // 4 > settings.RECIPE_IMAGE_MAX_BYTES:
+            self.fail('too_large', max_bytes=settings.RECIPE_IMAGE_MAX_BYTES)
+        upload = TemporaryUploadedFile(
+            'temp.' + ext, 'image/' + ext, 0, None)
+        try:
+            for start in range(0, len(imgstr), self.chunk_size):
+                upload.write(base64.b64decode(
+                    imgstr[start:start + self.chunk_size]))
+        except binascii.Error:
+            upload.close()
+            self.fail('invalid_base64')
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+    def check_limits(self, data):
+        if data.size > settings.RECIPE_IMAGE_MAX_BYTES:
+            self.fail('too_large', max_bytes=settings.RECIPE_IMAGE_MAX_BYTES)
+        try:
+            # Only the header is read here, nothing is decoded yet.
+            with Image.open(data) as image:
+                width, height = image.size
+        except Exception:
+            return
+        finally:
+            data.seek(0)
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            self.fail('too_many_pixels',
+                      max_pixels=settings.RECIPE_IMAGE_MAX_PIXELS)
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-
-        return super().to_internal_value(data)
+            data = self.decode(data)
+        try:
+            if getattr(data, 'size', None) is not None:
+                self.check_limits(data)
+            return super().to_internal_value(data)
+        except serializers.ValidationError:
+            if hasattr(data, 'close'):
+                data.close()
+            raise
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
@@ -109,73 +178,172 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         default=serializers.CurrentUserDefault()
     )
     ingredients = IngredientAmountCreateSerializer(many=True)
+    multipart_json_fields = ('ingredients', )
 
     class Meta:
         model = Recipe
         fields = ('tags', 'name', 'image', 'text', 'cooking_time', 'author',
                   'ingredients', )
 
+    def to_internal_value(self, data):
+        # Multipart bodies carry tags as repeated keys and the nested
+        # ingredients as a JSON string.
+        if html.is_html_input(data):
+            parsed = {}
+            for key in data:
+                if isinstance(self.fields.get(key),
+                              serializers.ManyRelatedField):
+                    parsed[key] = data.getlist(key)
+                elif key in self.multipart_json_fields:
+                    try:
+                        parsed[key] = json.loads(data[key])
+                    except ValueError:
+                        raise serializers.ValidationError(
+                            {key: 'Send {0} as a JSON list'.format(key)})
+                else:
+                    parsed[key] = data[key]
+            data = parsed
+        return super().to_internal_value(data)
+
     def validate(self, data):
-        tags = data['tags']
-        ingredients = data['ingredients']
-        if not isinstance(tags, list) or len(tags) < 1:
-            raise serializers.ValidationError('tags is a list with tag ids')
-        if len(tags) != len(set(tags)):
-            raise serializers.ValidationError('tags should be unique')
-        unique_ids = set()
-        for ing in ingredients:
-            if ing['amount'] < 1:
+        if 'tags' in data:
+            tags = data['tags']
+            if not isinstance(tags, list) or len(tags) < 1:
+                raise serializers.ValidationError(
+                    'tags is a list with tag ids')
+            if len(tags) != len(set(tags)):
+                raise serializers.ValidationError('tags should be unique')
+        if 'ingredients' in data:
+            ingredients = data['ingredients']
+            unique_ids = set()
+            for ing in ingredients:
+                if ing['amount'] < 1:
+                    raise serializers.ValidationError(
+                        'amount is a positive integer')
+                unique_ids.add(ing['ingredient']['pk'])
+            if len(ingredients) != len(unique_ids):
                 raise serializers.ValidationError(
-                    'amount is a positive integer')
-            unique_ids.add(ing['ingredient']['pk'])
-        if len(ingredients) != len(unique_ids):
-            raise serializers.ValidationError('Ingredients should be unique')
+                    'Ingredients should be unique')
+            found = Ingredient.objects.only('id').in_bulk(unique_ids)
+            missing = sorted(unique_ids - set(found))
+            if missing:
+                raise serializers.ValidationError({'ingredients': [
+                    'Ingredient {0} does not exist'.format(pk)
+                    for pk in missing
+                ]})
         return data
 
+    def save(self, **kwargs):
+        # Closing drops the temporary file of an upload the storage has
+        # not moved into place.
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
+
     def to_representation(self, instance):
+        request = self.context['request']
+        instance = Recipe.objects.for_display().with_viewer_flags(
+            request.user).get(pk=instance.pk)
         serializer = RecipeSerializer(instance,
-                                      context={
-                                          'request': self.context['request']})
+                                      context={'request': request})
         return serializer.data
 
     def create_ingredients(self, recipe, ingredients):
-        ingredients_for_bulk_create = []
-        for ing in ingredients:
-            ingredient = get_object_or_404(
-                Ingredient, pk=ing['ingredient']['pk'])
-            ingredients_for_bulk_create.append(
-                IngredientAmount(
-                    ingredient=ingredient,
-                    recipe=recipe,
-                    amount=ing['amount'],
-                )
+        IngredientAmount.objects.bulk_create([
+            IngredientAmount(
+                ingredient_id=ing['ingredient']['pk'],
+                recipe=recipe,
+                amount=ing['amount'],
             )
-        IngredientAmount.objects.bulk_create(ingredients_for_bulk_create)
-
+            for ing in ingredients
+        ])
+
+    def update_ingredients(self, recipe, ingredients):
+        current = {amount.ingredient_id: amount
+                   for amount in recipe.ingredients.all()}
+        wanted = {ing['ingredient']['pk']: ing['amount']
+                  for ing in ingredients}
+        to_delete = [amount.pk for pk, amount in current.items()
+                     if pk not in wanted]
+        to_update = []
+        to_create = []
+        for pk, amount in wanted.items():
+            if pk not in current:
+                to_create.append(IngredientAmount(
+                    ingredient_id=pk, recipe=recipe, amount=amount))
+            elif current[pk].amount != amount:
+                current[pk].amount = amount
+                to_update.append(current[pk])
+        if to_delete:
+            IngredientAmount.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientAmount.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            IngredientAmount.objects.bulk_create(to_create)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
-        self.create_ingredients(recipe, ingredients)
+        with batch_ingredients(recipe.pk, in_carts=False):
+            recipe.tags.set(tags)
+            self.create_ingredients(recipe, ingredients)
+        update_search_index([recipe.pk])
+        schedule_processing(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.all().delete()
-        super().update(instance=instance, validated_data=validated_data)
-        self.create_ingredients(instance, ingredients)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        in_carts = ingredients is not None and instance.shopping_cart_count > 0
+        with batch_ingredients(instance.pk, in_carts):
+            if tags is not None:
+                instance.tags.set(tags)
+            if ingredients is not None:
+                self.update_ingredients(instance, ingredients)
+        if in_carts:
+            touch_carts(instance.pk)
+        if 'image' in validated_data:
+            reset_variants(instance)
+        instance = super().update(instance=instance,
+                                  validated_data=validated_data)
+        if 'image' in validated_data:
+            schedule_processing(instance)
+        if (ingredients is not None or 'name' in validated_data
+                or 'text' in validated_data):
+            update_search_index([instance.pk])
         return instance
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
+    image = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time', )
 
+    def get_image(self, obj):
+        request = self.context.get('request')
+        if request is None:
+            return obj.thumbnail_url
+        return request.build_absolute_uri(obj.thumbnail_url)
+
+
+def get_recipes_limit(request):
+    limit = request.query_params.get('recipes_limit')
+    if not limit:
+        return None
+    try:
+        return max(1, int(limit))
+    except ValueError:
+        raise serializers.ValidationError(
+            {'recipes_limit': 'recipes_limit is a positive integer'})
+
 
 class UserWithShortRecipesSerializer(DjoserUserSerializer):
     recipes = serializers.SerializerMethodField()
@@ -187,99 +355,24 @@ class UserWithShortRecipesSerializer(DjoserUserSerializer):
                   'is_subscribed', 'recipes', 'recipes_count', )
 
     def get_recipes(self, obj):
-        limit = self.context['request'].query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            limit = max(1, int(limit))
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(obj.pk, [])
+        else:
+            limit = self.context.get('recipes_limit')
+            if limit is None:
+                limit = get_recipes_limit(self.context['request'])
             recipes = obj.recipes.all()[:limit]
         result = ShortRecipeSerializer(recipes, many=True)
         return result.data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
-        default=serializers.CurrentUserDefault(),
-        required=False,
-    )
-    recipe = serializers.PrimaryKeyRelatedField(
-        queryset=Recipe.objects.all(),
-        required=False,
+class BatchIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RELATION_BATCH_MAX_SIZE,
     )
-
-    class Meta:
-        model = Favorite
-        fields = ('user', 'recipe', )
-        validators = [
-            UniqueTogetherValidator(
-                queryset=Favorite.objects.all(),
-                fields=['user', 'recipe']
-            )
-        ]
-
-    def to_representation(self, instance):
-        serializer = ShortRecipeSerializer(
-            instance.recipe, context={'request': self.context['request']})
-        return serializer.data
-
-
-class ShopItemSerializer(serializers.ModelSerializer):
-    user = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
-        default=serializers.CurrentUserDefault(),
-        required=False,
-    )
-    recipe = serializers.PrimaryKeyRelatedField(
-        queryset=Recipe.objects.all(),
-        required=False,
-    )
-
-    class Meta:
-        model = ShopItem
-        fields = ('user', 'recipe', )
-        validators = [
-            UniqueTogetherValidator(
-                queryset=ShopItem.objects.all(),
-                fields=['user', 'recipe']
-            )
-        ]
-
-    def to_representation(self, instance):
-        serializer = ShortRecipeSerializer(
-            instance.recipe, context={'request': self.context['request']})
-        return serializer.data
-
-
-class FollowSerialzier(serializers.ModelSerializer):
-    follower = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
-        default=serializers.CurrentUserDefault(),
-        required=False,
-    )
-    following = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all(),
-        required=False,
-    )
-
-    class Meta:
-        model = Follow
-        fields = ('follower', 'following', )
-
-    def validate(self, data):
-        follower_id = data.get('follower')
-        following_id = data.get('following')
-        if follower_id == following_id:
-            raise serializers.ValidationError(
-                'It is impossible to follow youself.')
-        if Follow.objects.filter(follower=follower_id,
-                                 following=following_id).exists():
-            raise serializers.ValidationError('Such follow already exist.')
-        return data
-
-    def to_representation(self, instance):
-        serializer = UserWithShortRecipesSerializer(
-            instance.following, context={'request': self.context['request']})
-        return serializer.data
@@ -0,0 +1,59 @@
+import csv
+import json
+
+from django.db.models import F
+
+from recipes.models import ShoppingListItem
+
+FILE_FORMATS = {
+    'txt': 'text/plain; charset=UTF-8',
+    'csv': 'text/csv; charset=UTF-8',
+    'json': 'application/json; charset=UTF-8',
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def get_shopping_list(user):
+    return ShoppingListItem.objects.filter(user=user).values(
+        'ingredient__name', 'ingredient__measurement_unit',
+        total_amount=F('amount'),
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def render_txt(rows):
+    for row in rows:
+        yield '{0}: {1} {2}\n'.format(row['ingredient__name'],
+                                      row['total_amount'],
+                                      row['ingredient__measurement_unit'])
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for row in rows:
+        yield writer.writerow((row['ingredient__name'],
+                               row['total_amount'],
+                               row['ingredient__measurement_unit']))
+
+
+def render_json(rows):
+    separator = '['
+    for row in rows:
+        yield separator + json.dumps({
+            'name': row['ingredient__name'],
+            'amount': row['total_amount'],
+            'measurement_unit': row['ingredient__measurement_unit'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+RENDERERS = {
+    'txt': render_txt,
+    'csv': render_csv,
+    'json': render_json,
+}
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db import connections
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import evict_token
+from api.autocomplete import ingredient_index
+from api.cache import bump_version
+from api.representations import FRAGMENT_NAMESPACE
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.shopping_lists import is_batched
+from recipes.stamps import (RECIPES, touch_authors, touch_recipes,
+                            touch_users)
+
+User = get_user_model()
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+    bump_version('ingredients')
+    bump_version(FRAGMENT_NAMESPACE)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags_cache(sender, **kwargs):
+    bump_version('tags')
+    bump_version(FRAGMENT_NAMESPACE)
+
+
+def touch_tagged(recipes):
+    touch_recipes(recipes)
+    touch_authors(recipes)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_tagged_fragments(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    if reverse and action == 'pre_clear':
+        # The cleared recipes can only be found while still linked.
+        touch_tagged(Recipe.objects.filter(tags=instance))
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        if not is_batched(instance.pk):
+            touch_tagged(Recipe.objects.filter(pk=instance.pk))
+    elif pk_set:
+        touch_tagged(Recipe.objects.filter(pk__in=pk_set))
+    else:
+        bump_version(FRAGMENT_NAMESPACE)
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    evict_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def evict_user_tokens(sender, instance, created, **kwargs):
+    if created:
+        return
+    for key in Token.objects.filter(user=instance).values_list(
+            'key', flat=True):
+        evict_token(key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_fragments(sender, instance, created, update_fields,
+                                **kwargs):
+    if created or update_fields and not set(update_fields) & AUTHOR_FIELDS:
+        return
+    touch_users([instance.pk], RECIPES)
+    touch_recipes(Recipe.objects.filter(author=instance))
+
+
+@receiver(request_started)
+def close_unusable_connections(sender, **kwargs):
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
@@ -0,0 +1,530 @@
+import base64
+import json
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.authentication import CachedTokenAuthentication
+from api.autocomplete import ingredient_index
+from api.cache import get_version
+from api.renderers import FastJSONRenderer
+from api.representations import (build_fragments, get_fragment_key,
+                                 recipe_rows, represent_recipes)
+from api.serializers import RecipeSerializer
+from recipes.images import process_image
+from recipes.models import (Favorite, Follow, Ingredient, IngredientAmount,
+                            Recipe, ShopItem, Tag)
+
+User = get_user_model()
+
+
+def create_user(name):
+    return User.objects.create(username=name, email=name + '@example.com',
+                               first_name=name, last_name=name)
+
+
+def create_recipes(authors, total, tags, ingredients):
+    recipes = []
+    for number in range(total):
+        recipe = Recipe.objects.create(
+            author=authors[number % len(authors)], name='Recipe {0}'.format(
+                number), image='recipes/images/recipe.png', text='Text',
+            cooking_time=5)
+        recipe.tags.set(tags[:1 + number % len(tags)])
+        IngredientAmount.objects.bulk_create([
+            IngredientAmount(recipe=recipe, ingredient=ingredient,
+                             amount=number + 1)
+            for ingredient in ingredients
+        ])
+        recipes.append(recipe)
+    return recipes
+
+
+class APITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('viewer')
+        cls.authors = [create_user('author{0}'.format(number))
+                       for number in range(3)]
+        cls.tags = [Tag.objects.create(name='Tag {0}'.format(number),
+                                       color='#00000{0}'.format(number),
+                                       slug='tag{0}'.format(number))
+                    for number in range(3)]
+        cls.ingredients = [
+            Ingredient.objects.create(name='Ingredient {0}'.format(number),
+                                      measurement_unit='g')
+            for number in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class RecipeListQueriesTest(APITestCase):
+    def test_query_count_does_not_depend_on_page_size(self):
+        recipes = create_recipes(self.authors, 12, self.tags,
+                                 self.ingredients)
+        Favorite.objects.create(user=self.user, recipe=recipes[-1])
+        ShopItem.objects.create(user=self.user, recipe=recipes[-2])
+        Follow.objects.create(follower=self.user, following=self.authors[0])
+        cache.clear()
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/?limit=1')
+        self.assertEqual(len(response.data['results']), 1)
+        cache.clear()
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/?limit=10')
+        results = {recipe['id']: recipe for recipe in response.data['results']}
+        self.assertEqual(len(results), 10)
+        self.assertTrue(results[recipes[-1].pk]['is_favorited'])
+        self.assertTrue(results[recipes[-2].pk]['is_in_shopping_cart'])
+        self.assertFalse(results[recipes[-2].pk]['is_favorited'])
+        for recipe in results.values():
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['id'] == self.authors[0].pk)
+            self.assertEqual(len(recipe['ingredients']), 3)
+
+
+class PaginationTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_recipes(self.authors, 25, self.tags, self.ingredients)
+        self.ids = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+
+    def ids_of(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_page_and_limit_are_unchanged(self):
+        response = self.client.get('/api/recipes/?limit=10&page=2')
+        self.assertEqual(self.ids_of(response), self.ids[10:20])
+        self.assertEqual(response.data['count'], 25)
+        self.assertIn('page=3', response.data['next'])
+        self.assertEqual(response.data['previous'],
+                         'http://testserver/api/recipes/?limit=10')
+        self.assertNotIn('cursor', response.data['next'])
+
+    def test_cursor_round_trip(self):
+        response = self.client.get('/api/recipes/?limit=10&cursor=')
+        self.assertEqual(self.ids_of(response), self.ids[:10])
+        self.assertIsNone(response.data['previous'])
+        pages = []
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append(self.ids_of(response))
+        self.assertEqual(pages, [self.ids[10:20], self.ids[20:]])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self.ids_of(response), self.ids[10:20])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self.ids_of(response), self.ids[:10])
+        self.assertIsNone(response.data['previous'])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('garbage', 'eyJwIjpbMV0sInIiOmZhbHNlfQ=='):
+            response = self.client.get('/api/recipes/?cursor=' + cursor)
+            self.assertEqual(response.status_code, 404)
+
+    def test_count_can_be_skipped(self):
+        response = self.client.get('/api/recipes/?limit=10&cursor=')
+        self.assertEqual(response.data['count'], 25)
+        response = self.client.get(
+            '/api/recipes/?limit=10&cursor=&count=false')
+        self.assertIsNone(response.data['count'])
+        self.assertEqual(self.ids_of(response), self.ids[:10])
+        self.assertIn('count=false', response.data['next'])
+
+
+class TagFilterTest(APITestCase):
+    def test_any_and_all_modes(self):
+        # Recipe n is tagged with tag0 .. tag<n % 3>.
+        recipes = create_recipes(self.authors, 3, self.tags, self.ingredients)
+        query = '/api/recipes/?limit=10&tags=tag1&tags=tag2'
+        for url, expected in (
+                (query, recipes[1:]),
+                (query + '&tags_mode=any', recipes[1:]),
+                (query + '&tags_mode=all', recipes[2:]),
+                ('/api/recipes/?tags=tag0&tags_mode=all', recipes)):
+            response = self.client.get(url)
+            self.assertEqual(
+                sorted(recipe['id'] for recipe in response.data['results']),
+                [recipe.pk for recipe in expected], url)
+            self.assertEqual(response.data['count'], len(expected), url)
+
+
+class RecipeRepresentationTest(APITestCase):
+    def test_rows_render_like_the_serializer(self):
+        recipes = create_recipes(self.authors, 5, self.tags, self.ingredients)
+        Recipe.objects.filter(pk=recipes[0].pk).update(
+            text='Line\u2028separators\u2029and "quotes" </script>')
+        Favorite.objects.create(user=self.user, recipe=recipes[1])
+        ShopItem.objects.create(user=self.user, recipe=recipes[2])
+        Follow.objects.create(follower=self.user, following=self.authors[1])
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        for viewer in (self.user, AnonymousUser()):
+            request.user = viewer
+            expected = JSONRenderer().render(RecipeSerializer(
+                Recipe.objects.for_display().with_viewer_flags(viewer),
+                many=True, context={'request': request}).data)
+            actual = FastJSONRenderer().render(represent_recipes(
+                recipe_rows(Recipe.objects.with_viewer_flags(viewer))))
+            self.assertEqual(actual, expected)
+
+
+class RecipeFragmentTest(APITestCase):
+    def write_back(self, recipe_id, fragment, updated_at):
+        # What a reader that loaded the recipe before an edit would put
+        # back into the cache after the edit has committed.
+        cache.set(get_fragment_key(recipe_id, get_version('recipes')[0],
+                                   updated_at), fragment)
+
+    def test_stale_fragment_is_not_served_after_recipe_edit(self):
+        recipe = create_recipes(self.authors, 1, self.tags,
+                                self.ingredients)[0]
+        updated_at, fragment = build_fragments([recipe.pk])[recipe.pk]
+        recipe.name = 'Renamed'
+        recipe.save()
+        self.write_back(recipe.pk, fragment, updated_at)
+        response = self.client.get('/api/recipes/{0}/'.format(recipe.pk))
+        self.assertEqual(response.data['name'], 'Renamed')
+
+    def test_stale_fragment_is_not_served_after_author_edit(self):
+        recipe = create_recipes(self.authors, 1, self.tags,
+                                self.ingredients)[0]
+        updated_at, fragment = build_fragments([recipe.pk])[recipe.pk]
+        self.authors[0].first_name = 'Renamed'
+        self.authors[0].save()
+        self.write_back(recipe.pk, fragment, updated_at)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(
+            response.data['results'][0]['author']['first_name'], 'Renamed')
+
+
+class RecipeDetailTest(APITestCase):
+    def test_non_numeric_id_is_not_found(self):
+        for client in (self.client, APIClient()):
+            response = client.get('/api/recipes/abc/')
+            self.assertEqual(response.status_code, 404)
+
+
+class ShortRecipeImageTest(APITestCase):
+    def test_relation_responses_link_absolute_images(self):
+        recipe = create_recipes(self.authors, 1, self.tags,
+                                self.ingredients)[0]
+        expected = 'http://testserver/media/recipes/images/recipe.png'
+        for relation in ('favorite', 'shopping_cart'):
+            response = self.client.post('/api/recipes/{0}/{1}/'.format(
+                recipe.pk, relation))
+            self.assertEqual(response.data['image'], expected)
+
+
+class DownloadShoppingCartTest(APITestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        super().setUp()
+        for recipe in create_recipes(self.authors, 2, self.tags,
+                                     self.ingredients):
+            ShopItem.objects.create(user=self.user, recipe=recipe)
+
+    def download(self, file_format):
+        response = self.client.get(self.url, {'file_format': file_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=shoppinglist.' + file_format)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_txt_is_the_default(self):
+        expected = ''.join('Ingredient {0}: 3 g\n'.format(number)
+                           for number in range(3))
+        response, content = self.download('txt')
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; charset=UTF-8')
+        self.assertEqual(content, expected)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(), expected)
+
+    def test_csv(self):
+        response, content = self.download('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=UTF-8')
+        self.assertEqual(content, 'name,amount,measurement_unit\r\n' + ''.join(
+            'Ingredient {0},3,g\r\n'.format(number) for number in range(3)))
+
+    def test_json(self):
+        response, content = self.download('json')
+        self.assertEqual(response['Content-Type'],
+                         'application/json; charset=UTF-8')
+        self.assertEqual(json.loads(content), [
+            {'name': 'Ingredient {0}'.format(number), 'amount': 3,
+             'measurement_unit': 'g'} for number in range(3)])
+
+    def test_empty_cart_is_an_empty_json_list(self):
+        ShopItem.objects.filter(user=self.user).delete()
+        self.assertEqual(json.loads(self.download('json')[1]), [])
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get(self.url, {'file_format': 'pdf'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file_format', response.data)
+
+
+class IngredientEditStampsTest(APITestCase):
+    def test_ingredient_row_edit_changes_etags(self):
+        recipe = create_recipes(self.authors, 1, self.tags,
+                                self.ingredients)[0]
+        ShopItem.objects.create(user=self.user, recipe=recipe)
+        urls = ('/api/recipes/', '/api/recipes/{0}/'.format(recipe.pk),
+                '/api/recipes/download_shopping_cart/')
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        amount = recipe.ingredients.first()
+        amount.amount = 999
+        amount.save()
+        for url, etag in etags.items():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_tag_link_edit_changes_etags(self):
+        recipe = create_recipes(self.authors, 1, self.tags,
+                                self.ingredients)[0]
+        other = create_recipes(self.authors[1:], 1, self.tags,
+                               self.ingredients)[0]
+        other.tags.set(self.tags[1:])
+        urls = ('/api/recipes/', '/api/recipes/{0}/'.format(recipe.pk))
+        changes = (
+            lambda: recipe.tags.remove(self.tags[0]),
+            lambda: recipe.tags.add(self.tags[2]),
+            lambda: self.tags[2].recipes.remove(recipe),
+            lambda: self.tags[1].recipes.clear(),
+        )
+        for change in changes:
+            etags = {url: self.client.get(url)['ETag'] for url in urls}
+            change()
+            for url, etag in etags.items():
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200, url)
+        response = self.client.get('/api/recipes/{0}/'.format(other.pk))
+        self.assertEqual([tag['slug'] for tag in response.data['tags']],
+                         ['tag2'])
+
+
+@override_settings(INGREDIENT_INDEX_MAX_SIZE=0)
+class IngredientSearchTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        ingredient_index.invalidate()
+        for name in ('соль', 'морская соль', 'сахар', 'солод', 'фасоль'):
+            Ingredient.objects.create(name=name, measurement_unit='g')
+        # Loads the (empty) in-memory index once.
+        self.search(1)
+
+    def test_import_changes_etag(self):
+        etag = self.client.get('/api/ingredients/')['ETag']
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as source:
+            source.write('солянка,g\n')
+            source.flush()
+            call_command('import_ingredients', path=source.name,
+                         stdout=StringIO())
+        response = self.client.get('/api/ingredients/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('солянка', self.search(10))
+
+    def search(self, limit):
+        response = self.client.get('/api/ingredients/', {
+            'name': 'сол', 'limit': limit})
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_matches_come_first(self):
+        with self.assertNumQueries(2):
+            names = self.search(10)
+        self.assertEqual(names, ['солод', 'соль', 'морская соль', 'фасоль'])
+
+    def test_name_does_not_filter_detail(self):
+        sugar = Ingredient.objects.get(name='сахар')
+        response = self.client.get(
+            '/api/ingredients/{0}/'.format(sugar.pk), {'name': 'сол'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'сахар')
+
+    def test_substring_scan_skipped_when_prefixes_fill_limit(self):
+        with self.assertNumQueries(1):
+            names = self.search(2)
+        self.assertEqual(names, ['солод', 'соль'])
+
+
+class SubscriptionsQueriesTest(APITestCase):
+    def test_fifty_followed_authors_load_in_constant_queries(self):
+        authors = [create_user('followed{0}'.format(number))
+                   for number in range(50)]
+        for number, author in enumerate(authors):
+            Recipe.objects.bulk_create([
+                Recipe(author=author, name='Recipe {0}'.format(recipe),
+                       image='recipes/images/recipe.png', text='Text',
+                       cooking_time=5)
+                for recipe in range(number % 5)])
+            Follow.objects.create(follower=self.user, following=author)
+        call_command('recount_counters', stdout=StringIO())
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                '/api/users/subscriptions/?limit=50&recipes_limit=3')
+        self.assertEqual(len(response.data['results']), 50)
+        for author in response.data['results']:
+            expected = list(Recipe.objects.filter(
+                author=author['id']).order_by('-pub_date', '-id').values_list(
+                'id', flat=True))
+            self.assertEqual(
+                [recipe['id'] for recipe in author['recipes']], expected[:3])
+            self.assertEqual(author['recipes_count'], len(expected))
+            self.assertTrue(author['is_subscribed'])
+
+    def test_no_followed_authors(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+    def test_subscribe_represents_the_author(self):
+        author = self.authors[0]
+        create_recipes([author], 2, self.tags, self.ingredients)
+        response = self.client.post(
+            '/api/users/{0}/subscribe/?recipes_limit=1'.format(author.pk))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], author.pk)
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(response.data['recipes_count'], 2)
+        self.assertEqual(len(response.data['recipes']), 1)
+
+
+class RecipeEditQueriesTest(APITestCase):
+    def test_editing_thirty_ingredients_runs_fixed_queries(self):
+        ingredients = [
+            Ingredient.objects.create(name='Item {0}'.format(number),
+                                      measurement_unit='g')
+            for number in range(31)]
+        recipe = create_recipes([self.user], 1, self.tags,
+                                ingredients[:30])[0]
+        wanted = {ingredient.pk: 2 for ingredient in ingredients[1:]}
+        wanted[ingredients[1].pk] = 5
+        with self.assertNumQueries(17):
+            response = self.client.patch(
+                '/api/recipes/{0}/'.format(recipe.pk), {
+                    'ingredients': [{'id': pk, 'amount': amount}
+                                    for pk, amount in wanted.items()],
+                    'cooking_time': 10,
+                }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            {ingredient['id']: ingredient['amount']
+             for ingredient in response.data['ingredients']}, wanted)
+
+
+@override_settings(PERFORMANCE_METRICS_ENABLED=True,
+                   METRICS_SCRAPE_TOKEN='scrape-secret')
+class MetricsAccessTest(APITestCase):
+    def test_metrics_need_staff_or_scrape_token(self):
+        self.assertEqual(APIClient().get('/api/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        scraper = APIClient(HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(scraper.get('/api/metrics/').status_code, 200)
+        staff = create_user('staff')
+        staff.is_staff = True
+        staff.save()
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+    def test_server_timing_is_sent_to_staff_only(self):
+        self.assertNotIn('Server-Timing', APIClient().get('/api/tags/'))
+        staff = create_user('staff')
+        staff.is_staff = True
+        staff.save()
+        client = APIClient(HTTP_AUTHORIZATION='Token ' + Token.objects.create(
+            user=staff).key)
+        self.assertIn('Server-Timing', client.get('/api/tags/'))
+
+    def test_token_is_looked_up_once_per_request(self):
+        token = Token.objects.create(user=self.user).key
+        for header, expected in (('Token ' + token, 200),
+                                 ('Token ' + 'x' * 40, 401)):
+            client = APIClient(HTTP_AUTHORIZATION=header)
+            before = CachedTokenAuthentication.stats()
+            self.assertEqual(client.get('/api/tags/').status_code, expected)
+            after = CachedTokenAuthentication.stats()
+            self.assertEqual(sum(after.values()) - sum(before.values()), 1)
+
+    @override_settings(METRICS_SCRAPE_TOKEN='')
+    def test_empty_scrape_token_is_not_accepted(self):
+        client = APIClient(HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(client.get('/api/metrics/').status_code, 403)
+
+
+def encode_image(color):
+    buffer = BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+@override_settings(IMAGE_PROCESSING_WORKERS=0)
+class RecipeImageTest(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def post_recipe(self, image):
+        return self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 5}],
+            'tags': [self.tags[0].pk], 'image': image, 'name': 'Soup',
+            'text': 'Text', 'cooking_time': 10,
+        }, format='json')
+
+    def process(self, recipe):
+        with self.captureOnCommitCallbacks(execute=True):
+            process_image(recipe.pk, recipe.image.name)
+        recipe.refresh_from_db()
+        return [recipe.display_image.name, recipe.thumbnail.name]
+
+    def test_missing_base64_separator_is_rejected(self):
+        response = self.post_recipe('data:image/png,abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_old_variants_are_deleted(self):
+        response = self.post_recipe(encode_image('red'))
+        self.assertEqual(response.status_code, 201, response.data)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        first = self.process(recipe)
+        second = self.process(recipe)
+        for name in first:
+            self.assertFalse(default_storage.exists(name))
+        for name in second:
+            self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                '/api/recipes/{0}/'.format(recipe.pk),
+                {'image': encode_image('blue')}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        for name in second:
+            self.assertFalse(default_storage.exists(name))
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.thumbnail.name, '')
+        for name in self.process(recipe):
+            self.assertTrue(default_storage.exists(name))
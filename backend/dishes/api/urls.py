@@ -4,7 +4,8 @@ from rest_framework.routers import DefaultRouter
 from api.views import (DjoserUserViewSet, FavoriteViewSet,
                        FollowCreateDestroyViewSet, FollowListViewSet,
                        IngredientViewSet, RecipeViewSet, ShopItemViewSet,
-                       TagViewSet, download_shopping_cart, user_me)
+                       TagViewSet, download_shopping_cart, metrics,
+                       user_me)
 
 router = DefaultRouter()
 router.register('ingredients', IngredientViewSet, basename='ingredients')
@@ -17,9 +18,22 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics/', metrics, name='metrics'),
     path('users/me/', user_me, name='download-shop-items'),
     path('recipes/download_shopping_cart/',
          download_shopping_cart, name='download-shop-items'),
+    path('recipes/shopping_cart/',
+         ShopItemViewSet.as_view({'post': 'bulk_create',
+                                  'delete': 'bulk_destroy'}),
+         name='shopitem-bulk'),
+    path('recipes/favorite/',
+         FavoriteViewSet.as_view({'post': 'bulk_create',
+                                  'delete': 'bulk_destroy'}),
+         name='favorite-bulk'),
+    path('users/subscribe/',
+         FollowCreateDestroyViewSet.as_view({'post': 'bulk_create',
+                                             'delete': 'bulk_destroy'}),
+         name='follow-bulk'),
     path('recipes/<int:recipe_id>/shopping_cart/',
          ShopItemViewSet.as_view({'post': 'create', 'delete': 'destroy'}),
          name='shopitem-create-destroy'),
@@ -1,28 +1,86 @@
+import hmac
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.core.exceptions import PermissionDenied
+from django.db.models import BooleanField, Exists, OuterRef, Value
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import mixins, permissions, status, viewsets
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import (api_view, authentication_classes,
                                        permission_classes)
 from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 
+from api.authentication import CachedTokenAuthentication
+from api.autocomplete import ingredient_index
+from api.cache import (cached_response, conditional_response,
+                       set_validators, stamp_validators, stamped_response)
 from api.filters import FilterRecipe, SearchIngredientByName
+from api.metrics import registry
+from api.middleware import is_staff_request
 from api.pagination import LimitPageNumberPagination
+from api.parsers import LimitedMultiPartParser
 from api.permissions import CheckForOwnershipDELandPATCH
-from api.serializers import (DjoserUserSerializer, FavoriteSerializer,
-                             FollowSerialzier, IngredientSerializer,
-                             RecipeCreateSerializer, RecipeSerializer,
-                             ShopItemSerializer, TagSerializer,
-                             UserWithShortRecipesSerializer)
-from recipes.models import (Favorite, Follow, Ingredient, IngredientAmount,
-                            Recipe, ShopItem, Tag)
+from api.representations import (FRAGMENT_NAMESPACE, recipe_rows,
+                                 represent_recipes)
+from api.serializers import (BatchIdsSerializer, DjoserUserSerializer,
+                             IngredientSerializer, RecipeCreateSerializer,
+                             ShortRecipeSerializer, TagSerializer,
+                             UserWithShortRecipesSerializer, get_recipes_limit)
+from api.shopping_cart import FILE_FORMATS, RENDERERS, get_shopping_list
+from recipes.models import (Favorite, Follow, Ingredient, Recipe, ShopItem,
+                            Tag)
+from recipes.relations import add_links, remove_links
+from recipes.stamps import (CART, FAVORITES, FOLLOWS, RECIPES,
+                            VIEWER_STAMPS, get_stamps)
 
 User = get_user_model()
 
 
+class RelationViewSet(viewsets.ViewSet):
+    permission_classes = (permissions.IsAuthenticated, )
+    model = None
+    target_queryset = None
+    representation_class = None
+    lookup_url_kwarg = None
+
+    def get_target(self):
+        return get_object_or_404(self.target_queryset,
+                                 pk=self.kwargs[self.lookup_url_kwarg])
+
+    def get_ids(self):
+        serializer = BatchIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['ids']
+
+    def create(self, request, *args, **kwargs):
+        target = self.get_target()
+        if not add_links(self.model, request.user.pk, [target.pk]):
+            raise ValidationError('Such instance already exist.')
+        return Response(
+            self.representation_class(
+                target, context={'request': request}).data,
+            status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, *args, **kwargs):
+        target_id = self.kwargs[self.lookup_url_kwarg]
+        if not remove_links(self.model, request.user.pk, [target_id]):
+            get_object_or_404(self.target_queryset, pk=target_id)
+            raise ValidationError('Instance do not exist')
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def bulk_create(self, request, *args, **kwargs):
+        added = add_links(self.model, request.user.pk, self.get_ids())
+        return Response({'added': added}, status=status.HTTP_200_OK)
+
+    def bulk_destroy(self, request, *args, **kwargs):
+        removed = remove_links(self.model, request.user.pk, self.get_ids())
+        return Response({'removed': removed}, status=status.HTTP_200_OK)
+
+
 class TagViewSet(mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet,):
@@ -30,6 +88,15 @@ class TagViewSet(mixins.ListModelMixin,
     serializer_class = TagSerializer
     http_method_names = ['get', ]
     permission_classes = (permissions.AllowAny, )
+    cache_namespace = 'tags'
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
 
 class IngredientViewSet(mixins.ListModelMixin,
@@ -39,7 +106,29 @@ class IngredientViewSet(mixins.ListModelMixin,
     serializer_class = IngredientSerializer
     http_method_names = ['get', ]
     permission_classes = [permissions.AllowAny, ]
-    filter_backends = [SearchIngredientByName, ]
+    cache_namespace = 'ingredients'
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        try:
+            limit = int(request.query_params.get(
+                'limit', settings.INGREDIENT_AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'limit is a positive integer'})
+        limit = min(max(1, limit), settings.INGREDIENT_AUTOCOMPLETE_MAX_LIMIT)
+        results = ingredient_index.search(name, limit)
+        if results is None:
+            ingredients = SearchIngredientByName().search(
+                self.get_queryset(), name, limit)
+            results = self.get_serializer(ingredients, many=True).data
+        return Response(results)
+
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
 
 class DjoserUserViewSet(UserViewSet):
@@ -48,9 +137,20 @@ class DjoserUserViewSet(UserViewSet):
     permission_classes = [permissions.AllowAny, ]
     pagination_class = LimitPageNumberPagination
 
+    def get_queryset(self):
+        queryset = super().get_queryset().order_by('id')
+        if self.action not in ('list', 'retrieve', ):
+            return queryset
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.annotate(
+                is_subscribed=Value(False, output_field=BooleanField()))
+        return queryset.annotate(is_subscribed=Exists(Follow.objects.filter(
+            follower=user, following=OuterRef('pk'))))
+
 
 @api_view(['GET', ])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([permissions.IsAuthenticated])
 def user_me(request):
     serializer = DjoserUserSerializer(request.user,
@@ -65,12 +165,42 @@ class RecipeViewSet(viewsets.ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', ]
     pagination_class = LimitPageNumberPagination
     filter_backends = [FilterRecipe, ]
+    parser_classes = (JSONParser, LimitedMultiPartParser, )
+    lookup_value_regex = r'\d+'
+    stamp_namespace = FRAGMENT_NAMESPACE
+    serializer_class = RecipeCreateSerializer
 
-    def get_serializer_class(self):
-        if self.action in ('list', 'retrive', ):
-            return RecipeSerializer
-        else:
-            return RecipeCreateSerializer
+    def get_stamps(self):
+        latest_fields = (RECIPES, )
+        if self.request.query_params.get('ordering') == 'popular':
+            latest_fields += (FAVORITES, )
+        return get_stamps(self.request.user, VIEWER_STAMPS,
+                          recipe_id=self.kwargs.get('pk'),
+                          latest_fields=latest_fields)
+
+    def get_queryset(self):
+        # list and retrieve turn these into rows for represent_recipes;
+        # writes go through RecipeCreateSerializer.
+        if self.action in ('list', 'retrieve', ):
+            return Recipe.objects.with_viewer_flags(self.request.user)
+        return Recipe.objects.all()
+
+    @stamped_response
+    def list(self, request, *args, **kwargs):
+        queryset = recipe_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        data = represent_recipes(queryset if page is None else page)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    @stamped_response
+    def retrieve(self, request, *args, **kwargs):
+        data = represent_recipes(recipe_rows(
+            self.get_queryset().filter(pk=kwargs['pk'])))
+        if not data:
+            raise Http404
+        return Response(data[0])
 
 
 class FollowListViewSet(mixins.ListModelMixin,
@@ -80,122 +210,98 @@ class FollowListViewSet(mixins.ListModelMixin,
     http_method_names = ['get', ]
     pagination_class = LimitPageNumberPagination
     serializer_class = UserWithShortRecipesSerializer
+    stamp_namespace = None
+
+    def get_stamps(self):
+        return get_stamps(self.request.user, (FOLLOWS, ))
 
     def get_queryset(self):
         users_ids = Follow.objects.filter(
             follower=self.request.user).values('following')
-        return User.objects.filter(id__in=users_ids)
+        return User.objects.filter(id__in=users_ids).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).only('id', 'email', 'username', 'first_name', 'last_name',
+               'recipes_count').order_by('id')
 
+    @stamped_response
+    def list(self, request, *args, **kwargs):
+        limit = get_recipes_limit(request)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        authors = list(queryset if page is None else page)
+        recipes_by_author = {author.pk: [] for author in authors}
+        for recipe in Recipe.objects.latest_for_authors(
+                recipes_by_author, limit):
+            recipes_by_author[recipe.author_id].append(recipe)
+        context = self.get_serializer_context()
+        context.update(recipes_limit=limit,
+                       recipes_by_author=recipes_by_author)
+        serializer = self.get_serializer_class()(
+            authors, many=True, context=context)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
-class FollowCreateDestroyViewSet(mixins.CreateModelMixin,
-                                 mixins.DestroyModelMixin,
-                                 viewsets.GenericViewSet, ):
-    queryset = Follow.objects.all()
-    permission_classes = (permissions.IsAuthenticated, )
-    http_method_names = ['post', 'delete', ]
-    serializer_class = FollowSerialzier
 
-    def create(self, request, *args, **kwargs):
-        get_object_or_404(User, pk=self.kwargs.get('user_id'))
-        serializer = self.get_serializer(data={
-            'follower': request.user.pk,
-            'following': self.kwargs.get('user_id'),
-        })
-        serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(
-            serializer.data, status=status.HTTP_201_CREATED, headers=headers)
-
-    def get_object(self):
-        following = get_object_or_404(User, pk=self.kwargs.get('user_id'))
-        instance = self.queryset.filter(
-            following=following,
-            follower=self.request.user
-        )
-        if not instance.exists():
-            raise ValidationError('Instance do not exist')
-        return instance
+class FollowCreateDestroyViewSet(RelationViewSet):
+    model = Follow
+    target_queryset = User.objects.annotate(
+        is_subscribed=Value(True, output_field=BooleanField()))
+    representation_class = UserWithShortRecipesSerializer
+    lookup_url_kwarg = 'user_id'
+
+    def get_target(self):
+        if str(self.request.user.pk) == str(self.kwargs['user_id']):
+            raise ValidationError('It is impossible to follow youself.')
+        return super().get_target()
 
 
 @api_view(['GET', ])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([permissions.IsAuthenticated])
 def download_shopping_cart(request):
-    ingredients = IngredientAmount.objects.filter(
-        recipe__in=Recipe.objects.filter(
-            id__in=ShopItem.objects.filter(
-                user=request.user).values('recipe')
-        )
-    ).prefetch_related('ingredient')
-    name_amount = dict()
-    name_unit = dict()
-    for ing in ingredients:
-        name = ing.ingredient.name
-        if name in name_amount:
-            name_amount[name] += ing.amount
-        else:
-            name_amount[name] = ing.amount
-        name_unit[name] = ing.ingredient.measurement_unit
-    result = str()
-    for name, amount in name_amount.items():
-        result += name + ': ' + str(amount) + ' ' + name_unit[name] + '\n'
-    response = HttpResponse(
-        result,
-        content_type='text/plain; charset=UTF-8'
+    file_format = request.query_params.get('file_format', 'txt')
+    if file_format not in FILE_FORMATS:
+        raise ValidationError(
+            {'file_format': 'Choose one of: ' + ', '.join(FILE_FORMATS)})
+    etag, last_modified = stamp_validators(
+        request, get_stamps(request.user, (CART, ), latest_fields=()),
+        'ingredients')
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    rows = get_shopping_list(request.user).iterator()
+    response = StreamingHttpResponse(
+        RENDERERS[file_format](rows),
+        content_type=FILE_FORMATS[file_format]
     )
     response['Content-Disposition'] = ('attachment; filename={0}'.format(
-        'shoppinglist.txt'))
-    return response
+        'shoppinglist.' + file_format))
+    return set_validators(response, etag, last_modified)
 
 
-class FavoriteViewSet(mixins.CreateModelMixin,
-                      mixins.DestroyModelMixin,
-                      viewsets.GenericViewSet,):
-    queryset = Favorite.objects.all()
-    serializer_class = FavoriteSerializer
-    permission_classes = (permissions.IsAuthenticated, )
+class FavoriteViewSet(RelationViewSet):
+    model = Favorite
+    target_queryset = Recipe.objects.only(
+        'id', 'name', 'image', 'display_image', 'thumbnail', 'cooking_time')
+    representation_class = ShortRecipeSerializer
+    lookup_url_kwarg = 'recipe_id'
 
-    def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data={
-            'user': self.request.user.pk,
-            'recipe': self.kwargs.get('recipe_id')
-        })
-        serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(
-            serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-    def get_object(self):
-        recipe = get_object_or_404(Recipe, pk=self.kwargs.get('recipe_id'))
-        instance = self.queryset.filter(recipe=recipe, user=self.request.user)
-        if not instance.exists():
-            raise ValidationError('Instance do not exist')
-        return instance
+class ShopItemViewSet(FavoriteViewSet):
+    model = ShopItem
 
 
-class ShopItemViewSet(mixins.CreateModelMixin,
-                      mixins.DestroyModelMixin,
-                      viewsets.GenericViewSet,):
-    queryset = ShopItem.objects.all()
-    serializer_class = ShopItemSerializer
-    permission_classes = (permissions.IsAuthenticated, )
+def has_scrape_token(request):
+    token = settings.METRICS_SCRAPE_TOKEN
+    return bool(token) and hmac.compare_digest(
+        request.headers.get('Authorization', ''), 'Bearer ' + token)
 
-    def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data={
-            'user': self.request.user.pk,
-            'recipe': self.kwargs.get('recipe_id')
-        })
-        serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(
-            serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-    def get_object(self):
-        recipe = get_object_or_404(Recipe, pk=self.kwargs.get('recipe_id'))
-        instance = self.queryset.filter(recipe=recipe, user=self.request.user)
-        if not instance.exists():
-            raise ValidationError('Instance do not exist')
-        return instance
+def metrics(request):
+    if not settings.PERFORMANCE_METRICS_ENABLED:
+        raise Http404
+    if not (is_staff_request(request) or has_scrape_token(request)):
+        raise PermissionDenied
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,33 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Outside of requests (management commands, shell) reads stay on the
+# primary; ReplicaPinningMiddleware releases safe requests to the replicas.
+use_primary = ContextVar('use_primary', default=True)
+
+
+class ReplicaRouter:
+    route_app_labels = {'recipes', 'user'}
+
+    def db_for_read(self, model, **hints):
+        if (not settings.DATABASE_REPLICAS
+                or model._meta.app_label not in self.route_app_labels
+                or use_primary.get()
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
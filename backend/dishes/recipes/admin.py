@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from recipes.models import (Favorite, Follow, Ingredient, IngredientAmount,
                             Recipe, ShopItem, Tag)
+from recipes.images import reset_variants, schedule_processing
+from recipes.search import update_index
 
 User = get_user_model()
 
@@ -19,18 +22,27 @@ class IngredientAmountInline(admin.StackedInline):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author', 'favorite_count', )
+    list_display = ('id', 'name', 'author', 'favorites_count', )
     list_filter = ('name', 'author', 'tags', )
-    readonly_fields = ('favorite_count', )
-
-    def favorite_count(self, obj):
-        return Favorite.objects.filter(recipe=obj.id).count()
-    favorite_count.short_description = 'Favorite count'
+    readonly_fields = ('favorites_count', )
+    list_select_related = ('author', )
 
     inlines = [
         IngredientAmountInline,
     ]
 
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            reset_variants(obj)
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            schedule_processing(obj)
+
+    @transaction.atomic
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_index([form.instance.pk])
+
 
 class IngredientAmountAdmin(admin.ModelAdmin):
     list_display = ('ingredient', 'amount', 'recipe', )
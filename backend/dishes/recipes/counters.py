@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Favorite, Follow, Recipe, ShopItem
+
+User = get_user_model()
+
+# (model, counter field, counted model, foreign key to the model)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShopItem, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'following'),
+)
+
+
+def change_counter(queryset, field, delta):
+    return queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def actual_count(related, foreign_key):
+    return Coalesce(
+        Subquery(
+            related.objects.filter(**{foreign_key: OuterRef('pk')})
+            .order_by().values(foreign_key)
+            .annotate(total=Count('pk')).values('total')
+        ),
+        0,
+    )
+
+
+def repair_counter(model, field, related, foreign_key, dry_run=False):
+    actual = actual_count(related, foreign_key)
+    drifted = model.objects.annotate(actual=actual).exclude(
+        **{field: F('actual')})
+    total = drifted.count()
+    if total and not dry_run:
+        model.objects.filter(pk__in=drifted.values('pk')).update(
+            **{field: actual})
+    return total
@@ -0,0 +1,131 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# field: setting holding its bounding box
+VARIANTS = {
+    'display_image': 'RECIPE_IMAGE_DISPLAY_SIZE',
+    'thumbnail': 'RECIPE_IMAGE_THUMBNAIL_SIZE',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                thread_name_prefix='recipe-images')
+    return _executor
+
+
+def encode(image, name):
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        image, file_format, ext = image.convert('RGBA'), 'PNG', 'png'
+    else:
+        image, file_format, ext = image.convert('RGB'), 'JPEG', 'jpg'
+    buffer = io.BytesIO()
+    image.save(buffer, file_format, optimize=True, quality=85)
+    return ContentFile(buffer.getvalue(), name='{0}.{1}'.format(name, ext))
+
+
+def render_variants(source, name):
+    # Variants go from the largest box down, each one shrunk from the
+    # previous, so the upload is decoded once.
+    sizes = [(field, getattr(settings, size))
+             for field, size in VARIANTS.items()]
+    variants = {}
+    with Image.open(source) as image:
+        image.draft('RGB', sizes[0][1])
+        image = ImageOps.exif_transpose(image)
+        for field, size in sizes:
+            image.thumbnail(size)
+            variants[field] = encode(image, name)
+    return variants
+
+
+def delete_unreferenced(names):
+    # Another recipe may still point at the same file (copied or seeded
+    # rows), so only names nobody references any more are removed.
+    fields = ('image', *VARIANTS)
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{field + '__in': names})
+    referenced = set()
+    for row in Recipe.objects.filter(condition).values_list(*fields):
+        referenced.update(row)
+    storage = Recipe._meta.get_field('image').storage
+    for name in names:
+        if name not in referenced:
+            storage.delete(name)
+
+
+def delete_on_commit(names):
+    names = [name for name in names if name]
+    if names:
+        transaction.on_commit(lambda: delete_unreferenced(names))
+
+
+def reset_variants(recipe):
+    # Called when the original is replaced; the new variants are rendered
+    # by process_image and the old files go once the change commits.
+    delete_on_commit([getattr(recipe, field).name for field in VARIANTS])
+    for field in VARIANTS:
+        setattr(recipe, field, '')
+
+
+def process_image(recipe_id, image_name):
+    storage = Recipe._meta.get_field('image').storage
+    name = os.path.splitext(os.path.basename(image_name))[0]
+    with storage.open(image_name) as source:
+        variants = render_variants(source, name)
+    with transaction.atomic():
+        recipe = Recipe.objects.select_for_update().filter(
+            pk=recipe_id, image=image_name).first()
+        if recipe is None:
+            return
+        previous = [getattr(recipe, field).name for field in VARIANTS]
+        for field, content in variants.items():
+            getattr(recipe, field).save(content.name, content, save=False)
+        recipe.save(update_fields=[*VARIANTS, 'updated_at'])
+        delete_on_commit(previous)
+
+
+def run_processing(recipe_id, image_name):
+    try:
+        process_image(recipe_id, image_name)
+    except Exception:
+        logger.exception('Could not process image of recipe %s', recipe_id)
+
+
+def run_in_worker(recipe_id, image_name):
+    try:
+        run_processing(recipe_id, image_name)
+    finally:
+        connections.close_all()
+
+
+def schedule_processing(recipe):
+    # Variants are rendered after commit on a worker thread; until then
+    # the original upload is served. Without workers they are left to
+    # the process_recipe_images command.
+    if settings.IMAGE_PROCESSING_WORKERS <= 0:
+        return
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    transaction.on_commit(lambda: get_executor().submit(
+        run_in_worker, recipe_id, image_name))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from recipes.shopping_lists import find_drift, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Compare shopping lists with a full recompute from the carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Rebuild the lists of drifted users.')
+
+    def handle(self, *args, **options):
+        drifted = find_drift()
+        if drifted and options['repair']:
+            rebuild(drifted)
+        self.stdout.write('Shopping lists: {0} users {1}.'.format(
+            len(drifted), 'repaired' if options['repair'] else 'drifted'))
@@ -1,33 +1,126 @@
 import csv
-import io
-from os.path import join
+import json
+import time
+from os.path import join, splitext
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from api.autocomplete import ingredient_index
+from api.cache import bump_version
+from api.representations import FRAGMENT_NAMESPACE
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from recipes.models import Ingredient
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent.parent
+# The catalog lives in data/ at the repository root; the Docker image
+# mounts it at /app/data, next to the backend code.
+DATA_DIRS = (BASE_DIR.parent / 'data', BASE_DIR / 'data')
+DEFAULT_PATH = next(
+    (str(folder / 'ingredients.csv') for folder in DATA_DIRS
+     if (folder / 'ingredients.csv').exists()),
+    join(DATA_DIRS[-1], 'ingredients.csv'))
+FORMATS = ('csv', 'json')
+CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file, delimiter=','):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON source must be an array of objects.')
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Malformed JSON source.')
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item['name'], item['measurement_unit']
+        buffer = buffer[end:]
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
 
 
 class Command(BaseCommand):
-    help = 'Import csv file with data for Ingredients using Django ORM'
+    help = 'Import csv or json file with data for Ingredients in bulk'
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument('--path', default=DEFAULT_PATH,
+                            help='Source file, data/ingredients.csv '
+                                 'by default.')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Source format, taken from the file '
+                                 'extension if omitted.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Count new ingredients without saving.')
 
     def handle(self, *args, **options):
-        DATA_FOLDER = join(BASE_DIR, 'data')
-        csvfile = io.open(join(DATA_FOLDER, 'ingredients.csv'),
-                          encoding="utf-8")
-        file = csv.reader(csvfile, delimiter=',')
-        counter = 0
-        for row in file:
-            name = row[0]
-            measurement_unit = row[1]
-            obj, created = Ingredient.objects.get_or_create(
-                name=name,
-                measurement_unit=measurement_unit
-            )
-            if created:
-                counter += 1
-        print(counter, 'ingredients were added to database.')
+        path = options['path']
+        file_format = (options['format']
+                       or splitext(path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            raise CommandError(
+                'Unknown format {0}, use --format.'.format(file_format))
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size should be positive.')
+        dry_run = options['dry_run']
+        try:
+            file = open(path, encoding='utf-8')
+        except OSError as error:
+            raise CommandError(error)
+
+        started = time.monotonic()
+        seen = set(Ingredient.objects.values_list('name', 'measurement_unit'))
+        rows = created = 0
+        batch = []
+        with file, transaction.atomic():
+            for name, measurement_unit in READERS[file_format](file):
+                rows += 1
+                key = (name.strip(), measurement_unit.strip())
+                if not all(key) or key in seen:
+                    continue
+                seen.add(key)
+                created += 1
+                if dry_run:
+                    continue
+                batch.append(Ingredient(name=key[0],
+                                        measurement_unit=key[1]))
+                if len(batch) >= batch_size:
+                    Ingredient.objects.bulk_create(batch,
+                                                   ignore_conflicts=True)
+                    batch = []
+            if batch:
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        if created and not dry_run:
+            # bulk_create sends no post_save, so the caches the Ingredient
+            # signals would have reset are reset here.
+            ingredient_index.invalidate()
+            bump_version('ingredients')
+            bump_version(FRAGMENT_NAMESPACE)
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(
+            '{0} rows read, {1} ingredients {2} in {3:.2f}s '
+            '({4:.0f} rows/sec).'.format(
+                rows, created,
+                'would be added' if dry_run else 'were added to database',
+                elapsed, rows / elapsed))
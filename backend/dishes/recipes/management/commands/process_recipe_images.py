@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from recipes.images import run_processing
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Render display images and thumbnails missing from recipes'
+
+    def handle(self, *args, **options):
+        pending = Recipe.objects.filter(thumbnail='').values_list(
+            'id', 'image').order_by('id')
+        total = 0
+        for recipe_id, image_name in pending.iterator():
+            run_processing(recipe_id, image_name)
+            total += 1
+        self.stdout.write('{0} recipe images processed.'.format(total))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from recipes.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of recipes'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write('Search index rebuilt.')
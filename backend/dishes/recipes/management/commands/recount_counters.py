@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from recipes.counters import COUNTERS, repair_counter
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized counters and repair any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report drifted rows.')
+
+    def handle(self, *args, **options):
+        for model, field, related, foreign_key in COUNTERS:
+            drifted = repair_counter(model, field, related, foreign_key,
+                                     dry_run=options['dry_run'])
+            self.stdout.write('{0}.{1}: {2} rows {3}.'.format(
+                model.__name__, field, drifted,
+                'drifted' if options['dry_run'] else 'repaired'))
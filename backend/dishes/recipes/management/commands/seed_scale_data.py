@@ -0,0 +1,241 @@
+import csv
+import io
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from recipes.management.commands.import_ingredients import DEFAULT_PATH
+from recipes.models import (Favorite, Follow, Ingredient, IngredientAmount,
+                            Recipe, ShopItem, Tag)
+
+User = get_user_model()
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#D2A875', 'dessert'),
+    ('Выпечка', '#C2557A', 'baking'),
+    ('Суп', '#3C8DBC', 'soup'),
+    ('Салат', '#7FBF3F', 'salad'),
+    ('Напитки', '#5BC0DE', 'drinks'),
+)
+IMAGE = 'recipes/images/seed.png'
+
+
+def zipf_weights(size, exponent):
+    return list(itertools.accumulate(
+        1 / (rank ** exponent) for rank in range(1, size + 1)))
+
+
+class Command(BaseCommand):
+    help = 'Generate a large skewed dataset for performance testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--favorites', type=int, default=50000)
+        parser.add_argument('--cart', type=int, default=20000)
+        parser.add_argument('--tags', type=int, default=len(TAGS),
+                            help='Tags to link recipes to; ones past the '
+                                 'built-in list are generated.')
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=10)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of popularity.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Recipes are published over this many '
+                                 'days before now.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--ingredients-path', default=DEFAULT_PATH)
+
+    def handle(self, *args, **options):
+        if (options['users'] < 2 or options['recipes'] < 1
+                or options['tags'] < 1):
+            raise CommandError('Need at least 2 users, 1 recipe and 1 tag.')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        self.use_copy = connection.vendor == 'postgresql'
+        self.now = timezone.now()
+        self.period = max(options['days'], 1) * 86400 * 10 ** 6
+
+        if not Ingredient.objects.exists():
+            call_command('import_ingredients',
+                         path=options['ingredients_path'],
+                         stdout=self.stdout)
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True))
+        self.random.shuffle(ingredient_ids)
+        tags = list(TAGS[:options['tags']]) + [
+            ('Тег {0}'.format(number), '#{0:06X}'.format(number),
+             'tag-{0}'.format(number))
+            for number in range(len(TAGS), options['tags'])]
+        Tag.objects.bulk_create(
+            [Tag(name=name, color=color, slug=slug)
+             for name, color, slug in tags],
+            ignore_conflicts=True)
+        tag_ids = list(Tag.objects.filter(
+            slug__in=[slug for _, _, slug in tags]).order_by(
+            'id').values_list('id', flat=True))
+
+        with transaction.atomic():
+            user_ids = self.create_users(options['users'], options['seed'])
+            recipe_ids = self.create_recipes(options['recipes'], user_ids)
+            self.write(
+                Recipe.tags.through, ('recipe_id', 'tag_id'),
+                self.links(recipe_ids, tag_ids,
+                           options['tags_per_recipe']))
+            self.write(
+                IngredientAmount, ('recipe_id', 'ingredient_id', 'amount'),
+                ((recipe, ingredient, self.random.randint(1, 500))
+                 for recipe, ingredient in self.links(
+                     recipe_ids, ingredient_ids,
+                     options['ingredients_per_recipe'])))
+            self.write(
+                Follow, ('follower_id', 'following_id'),
+                self.relations(user_ids, user_ids, options['follows'],
+                               exclude_self=True))
+            self.write(
+                Favorite, ('user_id', 'recipe_id'),
+                self.relations(user_ids, recipe_ids, options['favorites']))
+            self.write(
+                ShopItem, ('user_id', 'recipe_id'),
+                self.relations(user_ids, recipe_ids, options['cart']))
+        call_command('recount_counters', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('check_shopping_lists', repair=True, stdout=self.stdout)
+
+    def create_users(self, total, seed):
+        password = make_password('seed-password')
+        last_id = User.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+        prefix = 'seed{0}-{1}'.format(seed, last_id)
+        self.write(User, (
+            'username', 'email', 'first_name', 'last_name', 'password',
+            'is_active', 'is_staff', 'is_superuser', 'date_joined',
+            'recipes_count', 'followers_count', 'recipes_changed_at',
+            'favorites_changed_at', 'cart_changed_at', 'follows_changed_at',
+        ), ((
+            '{0}-{1}'.format(prefix, number),
+            '{0}-{1}@example.com'.format(prefix, number),
+            'Seed', 'User {0}'.format(number), password,
+            True, False, False, self.now, 0, 0, self.now, self.now,
+            self.now, self.now,
+        ) for number in range(total)))
+        return list(User.objects.filter(id__gt=last_id).order_by(
+            'id').values_list('id', flat=True))
+
+    def create_recipes(self, total, user_ids):
+        last_id = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+        weights = zipf_weights(len(user_ids), self.skew)
+        self.write(Recipe, (
+            'author_id', 'name', 'image', 'text', 'cooking_time',
+            'pub_date', 'updated_at', 'favorites_count',
+            'shopping_cart_count', 'display_image', 'thumbnail',
+        ), (self.recipe(number, user_ids, weights) for number in range(total)))
+        return list(Recipe.objects.filter(id__gt=last_id).order_by(
+            'id').values_list('id', flat=True))
+
+    def recipe(self, number, user_ids, weights):
+        # Publication times are spread over --days so the (-pub_date, -id)
+        # keyset sees realistic, mostly distinct timestamps.
+        published = self.now - timedelta(
+            microseconds=self.random.randrange(self.period))
+        return (
+            self.random.choices(user_ids, cum_weights=weights)[0],
+            'Рецепт {0}'.format(number), IMAGE,
+            'Сгенерированный рецепт {0}.'.format(number),
+            self.random.randint(1, 180), published, published, 0, 0, '', '',
+        )
+
+    def links(self, sources, targets, maximum):
+        weights = zipf_weights(len(targets), self.skew)
+        for source in sources:
+            count = self.random.randint(1, min(maximum, len(targets)))
+            for target in self.sample(targets, weights, count):
+                yield source, target
+
+    def relations(self, sources, targets, total, exclude_self=False):
+        activity = zipf_weights(len(sources), self.skew)
+        shares = [activity[0]] + [
+            current - previous
+            for previous, current in zip(activity, activity[1:])]
+        weights = zipf_weights(len(targets), self.skew)
+        order = list(sources)
+        self.random.shuffle(order)
+        for source, share in zip(order, shares):
+            count = min(round(total * share / activity[-1]),
+                        len(targets) - exclude_self)
+            for target in self.sample(targets, weights, count,
+                                      exclude=source if exclude_self
+                                      else None):
+                yield source, target
+
+    def sample(self, population, weights, count, exclude=None):
+        chosen = set()
+        attempts = 0
+        while len(chosen) < count and attempts < count * 10:
+            attempts += 1
+            value = self.random.choices(population, cum_weights=weights)[0]
+            if value != exclude:
+                chosen.add(value)
+        return sorted(chosen)
+
+    def write(self, model, fields, rows):
+        started = time.monotonic()
+        written = 0
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            written += len(batch)
+            if self.use_copy:
+                self.copy(model._meta.db_table, fields, batch)
+            else:
+                self.insert(model, fields, batch)
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write('{0}: {1} rows in {2:.1f}s ({3:.0f} rows/sec).'
+                          .format(model._meta.db_table, written, elapsed,
+                                  written / elapsed))
+
+    @staticmethod
+    def insert(model, fields, batch):
+        # Unlike bulk_create this keeps the given values of auto_now(_add)
+        # fields, the same as COPY does.
+        columns = [model._meta.get_field(field) for field in fields]
+        sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(field) for field in fields),
+            ', '.join(['%s'] * len(fields)))
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                [column.get_db_prep_save(value, connection)
+                 for column, value in zip(columns, row)]
+                for row in batch])
+
+    @staticmethod
+    def copy(table, fields, batch):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        columns = ', '.join(connection.ops.quote_name(field)
+                            for field in fields)
+        with connection.cursor() as cursor:
+            # Seeded columns are never NULL; empty strings stay empty.
+            cursor.copy_expert(
+                'COPY {0} ({1}) FROM STDIN WITH (FORMAT csv, '
+                'FORCE_NOT_NULL ({1}))'.format(
+                    connection.ops.quote_name(table), columns),
+                buffer)
@@ -0,0 +1,50 @@
+# Generated by Django 3.2 on 2026-10-17 13:11
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShopItem = apps.get_model('recipes', 'ShopItem')
+    Follow = apps.get_model('recipes', 'Follow')
+    User = apps.get_model('user', 'User')
+    counters = (
+        (Recipe, 'favorites_count', Favorite, 'recipe'),
+        (Recipe, 'shopping_cart_count', ShopItem, 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+        (User, 'followers_count', Follow, 'following'),
+    )
+    for model, field, related, foreign_key in counters:
+        model.objects.update(**{field: Coalesce(
+            Subquery(
+                related.objects.filter(**{foreign_key: OuterRef('pk')})
+                .order_by().values(foreign_key)
+                .annotate(total=Count('pk')).values('total')
+            ),
+            0,
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredient_name_search_index'),
+        ('user', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
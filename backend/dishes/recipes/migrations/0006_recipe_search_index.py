@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.db import migrations
+
+FTS_TABLE = 'recipes_recipe_search'
+GIN_INDEX = 'recipes_recipe_search_vector_idx'
+INGREDIENT_NAMES = (
+    "SELECT {0} FROM recipes_ingredientamount amount "
+    "JOIN recipes_ingredient ingredient "
+    "ON ingredient.id = amount.ingredient_id "
+    "WHERE amount.recipe_id = recipe.id"
+)
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe '
+            'ADD COLUMN IF NOT EXISTS search_vector tsvector')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS {0} ON recipes_recipe '
+            'USING GIN (search_vector)'.format(GIN_INDEX))
+        schema_editor.execute(
+            "UPDATE recipes_recipe recipe SET search_vector = "
+            "setweight(to_tsvector(%s::regconfig, "
+            "coalesce(recipe.name, '')), 'A') "
+            "|| setweight(to_tsvector(%s::regconfig, "
+            "coalesce(({0}), '')), 'B') "
+            "|| setweight(to_tsvector(%s::regconfig, "
+            "coalesce(recipe.text, '')), 'C')".format(
+                INGREDIENT_NAMES.format("string_agg(ingredient.name, ' ')")),
+            [settings.RECIPE_SEARCH_CONFIG] * 3)
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5("
+            "name, text, ingredients, "
+            "tokenize = 'unicode61 remove_diacritics 2')".format(FTS_TABLE))
+        schema_editor.execute(
+            "INSERT INTO {0} (rowid, name, text, ingredients) "
+            "SELECT recipe.id, recipe.name, recipe.text, "
+            "coalesce(({1}), '') FROM recipes_recipe recipe".format(
+                FTS_TABLE, INGREDIENT_NAMES.format(
+                    "group_concat(ingredient.name, ' ')")))
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(GIN_INDEX))
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {0}'.format(FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
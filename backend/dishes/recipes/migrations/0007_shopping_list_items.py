@@ -0,0 +1,42 @@
+# Generated by Django 3.2 on 2026-10-17 13:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_lists(apps, schema_editor):
+    schema_editor.execute(
+        'INSERT INTO recipes_shoppinglistitem '
+        '(user_id, ingredient_id, amount, recipes_count) '
+        'SELECT cart.user_id, ingredient.ingredient_id, '
+        'SUM(ingredient.amount), COUNT(*) '
+        'FROM recipes_shopitem cart JOIN recipes_ingredientamount ingredient '
+        'ON ingredient.recipe_id = cart.recipe_id '
+        'GROUP BY cart.user_id, ingredient.ingredient_id')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0006_recipe_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(default=0)),
+                ('recipes_count', models.PositiveIntegerField(default=0)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.ingredient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='only_unique_shopping_list_items'),
+        ),
+        migrations.RunPython(fill_shopping_lists, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,10 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import RowNumber
+
+from recipes.shopping_lists import (batch_ingredients,
+                                    remove_recipe_from_carts)
 
 User = get_user_model()
 
@@ -23,6 +27,67 @@ class Tag(models.Model):
         return str(self.slug)
 
 
+class RecipeQuerySet(models.QuerySet):
+    def latest_for_authors(self, author_ids, limit=None):
+        if not author_ids:
+            # An empty IN makes the compiler raise EmptyResultSet before
+            # the raw query below can be built.
+            return self.none()
+        recipes = self.filter(author__in=author_ids).only(
+            'id', 'name', 'image', 'display_image', 'thumbnail',
+            'cooking_time', 'author')
+        if limit is None:
+            return recipes
+        ranked = recipes.annotate(recipe_rank=models.Window(
+            expression=RowNumber(),
+            partition_by=[models.F('author')],
+            order_by=[models.F('pub_date').desc(), models.F('id').desc()],
+        )).values('id', 'name', 'image', 'display_image', 'thumbnail',
+                  'cooking_time', 'author', 'recipe_rank').order_by()
+        sql, params = ranked.query.sql_with_params()
+        return self.raw(
+            'SELECT * FROM ({0}) ranked WHERE recipe_rank <= %s '
+            'ORDER BY recipe_rank'.format(sql),
+            params + (limit, ),
+        )
+
+    def for_display(self):
+        return self.select_related('author').only(
+            'id', 'name', 'image', 'display_image', 'text', 'cooking_time',
+            'pub_date', 'author', 'author__email', 'author__username',
+            'author__first_name', 'author__last_name',
+        ).prefetch_related(
+            models.Prefetch(
+                'tags',
+                queryset=Tag.objects.only(
+                    'id', 'name', 'color', 'slug').order_by('id'),
+            ),
+            models.Prefetch(
+                'ingredients',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredient').only(
+                    'amount', 'recipe', 'ingredient',
+                    'ingredient__name', 'ingredient__measurement_unit',
+                ).order_by('id'),
+            ),
+        )
+
+    def with_viewer_flags(self, user):
+        if not user.is_authenticated:
+            false = models.Value(False, output_field=models.BooleanField())
+            return self.annotate(is_favorited=false,
+                                 is_in_shopping_cart=false,
+                                 author_is_subscribed=false)
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShopItem.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            author_is_subscribed=models.Exists(Follow.objects.filter(
+                follower=user, following=models.OuterRef('author'))),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -34,6 +99,16 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         blank=False,
     )
+    display_image = models.ImageField(
+        upload_to='recipes/display/',
+        blank=True,
+        editable=False,
+    )
+    thumbnail = models.ImageField(
+        upload_to='recipes/thumbnails/',
+        blank=True,
+        editable=False,
+    )
     text = models.TextField()
     tags = models.ManyToManyField(
         Tag,
@@ -42,12 +117,42 @@ class Recipe(models.Model):
     cooking_time = models.PositiveIntegerField(
         validators=[MinValueValidator(1, message='1 is minimal value')])
     pub_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     def __str__(self) -> str:
         return str(self.name)
 
+    def delete(self, *args, **kwargs):
+        # Takes the recipe out of the carts once instead of once per
+        # cascaded cart or ingredient row.
+        with transaction.atomic(savepoint=False), batch_ingredients(
+                self.pk, in_carts=False):
+            remove_recipe_from_carts(self.pk)
+            return super().delete(*args, **kwargs)
+
+    @property
+    def display_url(self):
+        return (self.display_image or self.image).url
+
+    @property
+    def thumbnail_url(self):
+        return (self.thumbnail or self.display_image or self.image).url
+
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date'],
+                         name='recipe_popular_idx'),
+        ]
 
 
 class Ingredient(models.Model):
@@ -106,6 +211,10 @@ class Follow(models.Model):
                 name='only_unique_follows',
             )
         ]
+        indexes = [
+            models.Index(fields=['following', 'follower'],
+                         name='follow_following_idx'),
+        ]
 
 
 class UserRecipe(models.Model):
@@ -140,3 +249,26 @@ class ShopItem(UserRecipe):
                 name='only_unique_shopitems',
             )
         ]
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    amount = models.PositiveIntegerField(default=0)
+    recipes_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='only_unique_shopping_list_items',
+            )
+        ]
@@ -0,0 +1,72 @@
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+
+from recipes.counters import change_counter
+from recipes.models import Favorite, Follow, Recipe, ShopItem
+from recipes.shopping_lists import add_recipes, remove_recipes
+from recipes.stamps import touch_owner
+
+User = get_user_model()
+
+# model: (owner column, target column, target model, counter field)
+RELATIONS = {
+    Favorite: ('user_id', 'recipe_id', Recipe, 'favorites_count'),
+    ShopItem: ('user_id', 'recipe_id', Recipe, 'shopping_cart_count'),
+    Follow: ('follower_id', 'following_id', User, 'followers_count'),
+}
+
+
+def add_links(model, owner_id, target_ids):
+    owner, target, target_model, counter = RELATIONS[model]
+    target_ids = sorted(set(target_ids))
+    if not target_ids:
+        return []
+    placeholders = ', '.join(['%s'] * len(target_ids))
+    sql = (
+        'INSERT INTO {table} ({owner}, {target}) '
+        'SELECT %s, id FROM {target_table} WHERE id IN ({placeholders}){self} '
+        'ON CONFLICT DO NOTHING RETURNING {target}'
+    ).format(
+        table=model._meta.db_table, owner=owner, target=target,
+        target_table=target_model._meta.db_table, placeholders=placeholders,
+        self=' AND id <> %s' if target_model is User else '',
+    )
+    params = [owner_id, *target_ids]
+    if target_model is User:
+        params.append(owner_id)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            added = [row[0] for row in cursor.fetchall()]
+        if added:
+            change_counter(target_model.objects.filter(pk__in=added),
+                           counter, 1)
+            if model is ShopItem:
+                add_recipes(owner_id, added)
+            touch_owner(model, owner_id)
+    return sorted(added)
+
+
+def remove_links(model, owner_id, target_ids):
+    owner, target, target_model, counter = RELATIONS[model]
+    target_ids = sorted(set(target_ids))
+    if not target_ids:
+        return []
+    sql = (
+        'DELETE FROM {table} WHERE {owner} = %s AND {target} IN '
+        '({placeholders}) RETURNING {target}'
+    ).format(
+        table=model._meta.db_table, owner=owner, target=target,
+        placeholders=', '.join(['%s'] * len(target_ids)),
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [owner_id, *target_ids])
+            removed = [row[0] for row in cursor.fetchall()]
+        if removed:
+            change_counter(target_model.objects.filter(pk__in=removed),
+                           counter, -1)
+            if model is ShopItem:
+                remove_recipes(owner_id, removed)
+            touch_owner(model, owner_id)
+    return sorted(removed)
@@ -0,0 +1,158 @@
+import re
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'recipes_recipe_search'
+GIN_INDEX = 'recipes_recipe_search_vector_idx'
+BATCH_SIZE = 500
+WORD = re.compile(r'\w+')
+
+INGREDIENT_NAMES = (
+    "SELECT {aggregate} FROM recipes_ingredientamount amount "
+    "JOIN recipes_ingredient ingredient "
+    "ON ingredient.id = amount.ingredient_id "
+    "WHERE amount.recipe_id = recipe.id"
+)
+POSTGRESQL_VECTOR = (
+    "setweight(to_tsvector(%s::regconfig, coalesce(recipe.name, '')), 'A') "
+    "|| setweight(to_tsvector(%s::regconfig, coalesce(({0}), '')), 'B') "
+    "|| setweight(to_tsvector(%s::regconfig, coalesce(recipe.text, '')), "
+    "'C')"
+).format(INGREDIENT_NAMES.format(
+    aggregate="string_agg(ingredient.name, ' ')"))
+SQLITE_ROWS = (
+    "SELECT recipe.id, recipe.name, recipe.text, coalesce(({0}), '') "
+    "FROM recipes_recipe recipe"
+).format(INGREDIENT_NAMES.format(
+    aggregate="group_concat(ingredient.name, ' ')"))
+
+
+def get_words(query):
+    return WORD.findall(query.lower())[:16]
+
+
+def get_config():
+    return settings.RECIPE_SEARCH_CONFIG
+
+
+def create_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe '
+            'ADD COLUMN IF NOT EXISTS search_vector tsvector')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS {0} ON recipes_recipe '
+            'USING GIN (search_vector)'.format(GIN_INDEX))
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5("
+            "name, text, ingredients, "
+            "tokenize = 'unicode61 remove_diacritics 2')".format(FTS_TABLE))
+
+
+def drop_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(GIN_INDEX))
+        schema_editor.execute(
+            'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {0}'.format(FTS_TABLE))
+
+
+def update_index(recipe_ids, using=DEFAULT_DB_ALIAS):
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        index_recipes(recipe_ids[start:start + BATCH_SIZE], using)
+
+
+def rebuild_index(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            config = get_config()
+            cursor.execute(
+                'UPDATE recipes_recipe recipe SET search_vector = '
+                + POSTGRESQL_VECTOR, [config] * 3)
+        elif connection.vendor == 'sqlite':
+            cursor.execute('DELETE FROM {0}'.format(FTS_TABLE))
+            cursor.execute(
+                'INSERT INTO {0} (rowid, name, text, ingredients) '.format(
+                    FTS_TABLE) + SQLITE_ROWS)
+
+
+def index_recipes(recipe_ids, using):
+    if not recipe_ids:
+        return
+    connection = connections[using]
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            config = get_config()
+            cursor.execute(
+                'UPDATE recipes_recipe recipe SET search_vector = '
+                + POSTGRESQL_VECTOR
+                + ' WHERE recipe.id IN ({0})'.format(placeholders),
+                [config] * 3 + recipe_ids)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                'DELETE FROM {0} WHERE rowid IN ({1})'.format(
+                    FTS_TABLE, placeholders), recipe_ids)
+            cursor.execute(
+                'INSERT INTO {0} (rowid, name, text, ingredients) '.format(
+                    FTS_TABLE) + SQLITE_ROWS
+                + ' WHERE recipe.id IN ({0})'.format(placeholders),
+                recipe_ids)
+
+
+def remove_from_index(recipe_ids, using=DEFAULT_DB_ALIAS):
+    recipe_ids = list(recipe_ids)
+    connection = connections[using]
+    if not recipe_ids or connection.vendor != 'sqlite':
+        return
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(
+            FTS_TABLE, placeholders), recipe_ids)
+
+
+def search_recipes(queryset, query):
+    words = get_words(query)
+    if not words:
+        return queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField())).none()
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(word + ':*' for word in words)
+        config = get_config()
+        return queryset.annotate(search_rank=RawSQL(
+            'ts_rank(recipes_recipe.search_vector, '
+            'to_tsquery(%s::regconfig, %s))', (config, tsquery),
+            output_field=FloatField(),
+        )).extra(
+            where=['recipes_recipe.search_vector @@ '
+                   'to_tsquery(%s::regconfig, %s)'],
+            params=[config, tsquery],
+        )
+    if vendor == 'sqlite':
+        match = ' '.join('"{0}"*'.format(word) for word in words)
+        return queryset.annotate(search_rank=RawSQL(
+            '(SELECT -bm25({0}, 10.0, 1.0, 5.0) FROM {0} '
+            'WHERE {0}.rowid = recipes_recipe.id AND {0} MATCH %s)'.format(
+                FTS_TABLE), (match, ),
+            output_field=FloatField(),
+        )).filter(id__in=RawSQL(
+            'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(FTS_TABLE),
+            (match, ),
+        ))
+    condition = Q()
+    for word in words:
+        condition &= (Q(name__icontains=word) | Q(text__icontains=word)
+                      | Q(ingredients__ingredient__name__icontains=word))
+    return queryset.annotate(
+        search_rank=Value(0.0, output_field=FloatField())).filter(
+        id__in=queryset.model.objects.filter(condition).values('id'))
@@ -0,0 +1,156 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+TABLE = 'recipes_shoppinglistitem'
+
+# Rows of (user_id, ingredient_id, amount, recipes) added to or taken
+# from the materialized shopping lists.
+USER_RECIPES = (
+    'SELECT %s AS user_id, ingredient_id, SUM(amount) AS amount, '
+    'COUNT(*) AS recipes FROM recipes_ingredientamount '
+    'WHERE recipe_id IN ({0}) GROUP BY ingredient_id'
+)
+RECIPE_CARTS = (
+    'SELECT cart.user_id, ingredient.ingredient_id, ingredient.amount, '
+    '1 AS recipes FROM recipes_shopitem cart '
+    'JOIN recipes_ingredientamount ingredient '
+    'ON ingredient.recipe_id = cart.recipe_id WHERE cart.recipe_id = %s'
+)
+INGREDIENT_CARTS = (
+    'SELECT user_id, %s AS ingredient_id, %s AS amount, 1 AS recipes '
+    'FROM recipes_shopitem WHERE recipe_id = %s'
+)
+ALL_CARTS = (
+    'SELECT cart.user_id, ingredient.ingredient_id, '
+    'SUM(ingredient.amount) AS amount, COUNT(*) AS recipes '
+    'FROM recipes_shopitem cart JOIN recipes_ingredientamount ingredient '
+    'ON ingredient.recipe_id = cart.recipe_id{0} '
+    'GROUP BY cart.user_id, ingredient.ingredient_id'
+)
+
+
+def add_contributions(sql, params, using):
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {0} (user_id, ingredient_id, amount, recipes_count) '
+            'SELECT * FROM ({1}) contribution WHERE true '
+            'ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+            'amount = {0}.amount + excluded.amount, '
+            'recipes_count = {0}.recipes_count + excluded.recipes_count'
+            .format(TABLE, sql), params)
+
+
+def subtract_contributions(sql, params, using):
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'UPDATE {0} SET '
+            'amount = CASE WHEN {0}.amount > contribution.amount '
+            'THEN {0}.amount - contribution.amount ELSE 0 END, '
+            'recipes_count = CASE WHEN {0}.recipes_count > '
+            'contribution.recipes THEN {0}.recipes_count - '
+            'contribution.recipes ELSE 0 END '
+            'FROM ({1}) contribution '
+            'WHERE {0}.user_id = contribution.user_id '
+            'AND {0}.ingredient_id = contribution.ingredient_id'
+            .format(TABLE, sql), params)
+        cursor.execute(
+            'DELETE FROM {0} WHERE recipes_count = 0 AND user_id IN '
+            '(SELECT user_id FROM ({1}) contribution)'.format(TABLE, sql),
+            params)
+
+
+def user_recipes(user_id, recipe_ids):
+    recipe_ids = list(recipe_ids)
+    sql = USER_RECIPES.format(', '.join(['%s'] * len(recipe_ids)))
+    return sql, [user_id, *recipe_ids]
+
+
+def add_recipes(user_id, recipe_ids, using=DEFAULT_DB_ALIAS):
+    if recipe_ids:
+        add_contributions(*user_recipes(user_id, recipe_ids), using)
+
+
+def remove_recipes(user_id, recipe_ids, using=DEFAULT_DB_ALIAS):
+    if recipe_ids:
+        subtract_contributions(*user_recipes(user_id, recipe_ids), using)
+
+
+def add_recipe_to_carts(recipe_id, using=DEFAULT_DB_ALIAS):
+    add_contributions(RECIPE_CARTS, [recipe_id], using)
+
+
+def remove_recipe_from_carts(recipe_id, using=DEFAULT_DB_ALIAS):
+    subtract_contributions(RECIPE_CARTS, [recipe_id], using)
+
+
+def add_ingredient_to_carts(recipe_id, ingredient_id, amount,
+                            using=DEFAULT_DB_ALIAS):
+    add_contributions(INGREDIENT_CARTS, [ingredient_id, amount, recipe_id],
+                      using)
+
+
+def remove_ingredient_from_carts(recipe_id, ingredient_id, amount,
+                                 using=DEFAULT_DB_ALIAS):
+    subtract_contributions(
+        INGREDIENT_CARTS, [ingredient_id, amount, recipe_id], using)
+
+
+# Recipes whose ingredients are being rewritten in bulk; the per-row
+# IngredientAmount signals leave them alone.
+_batched_recipes = ContextVar('batched_recipes', default=frozenset())
+
+
+def is_batched(recipe_id):
+    return recipe_id in _batched_recipes.get()
+
+
+@contextmanager
+def batch_ingredients(recipe_id, in_carts=True, using=DEFAULT_DB_ALIAS):
+    # bulk_create/bulk_update send no signals, so the whole recipe is
+    # taken out of the carts first and put back once the rows are written.
+    if in_carts:
+        remove_recipe_from_carts(recipe_id, using)
+    token = _batched_recipes.set(_batched_recipes.get() | {recipe_id})
+    try:
+        yield
+    finally:
+        _batched_recipes.reset(token)
+    if in_carts:
+        add_recipe_to_carts(recipe_id, using)
+
+
+def rebuild(user_ids=None, using=DEFAULT_DB_ALIAS):
+    condition, params = '', []
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        condition = ' WHERE cart.user_id IN ({0})'.format(
+            ', '.join(['%s'] * len(user_ids)))
+        params = user_ids
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {0}{1}'.format(TABLE, condition.replace(
+                'cart.user_id', 'user_id')), params)
+        cursor.execute(
+            'INSERT INTO {0} (user_id, ingredient_id, amount, recipes_count) '
+            '{1}'.format(TABLE, ALL_CARTS.format(condition)), params)
+
+
+def find_drift(using=DEFAULT_DB_ALIAS):
+    expected = ALL_CARTS.format('')
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT expected.user_id FROM ({1}) expected '
+            'LEFT JOIN {0} item ON item.user_id = expected.user_id '
+            'AND item.ingredient_id = expected.ingredient_id '
+            'WHERE item.id IS NULL OR item.amount <> expected.amount '
+            'OR item.recipes_count <> expected.recipes '
+            'UNION '
+            'SELECT item.user_id FROM {0} item '
+            'LEFT JOIN ({1}) expected ON item.user_id = expected.user_id '
+            'AND item.ingredient_id = expected.ingredient_id '
+            'WHERE expected.user_id IS NULL'.format(TABLE, expected))
+        return sorted(row[0] for row in cursor.fetchall())
@@ -0,0 +1,123 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from recipes.counters import change_counter
+from recipes.models import (Favorite, Follow, Ingredient, IngredientAmount,
+                            Recipe, ShopItem)
+from recipes.search import remove_from_index, update_index
+from recipes.shopping_lists import (add_ingredient_to_carts, add_recipes,
+                                    is_batched, remove_ingredient_from_carts,
+                                    remove_recipes)
+from recipes.stamps import (RECIPES, STAMPS, touch_authors, touch_carts,
+                            touch_owner, touch_recipes, touch_users)
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShopItem)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def increase_counters(sender, instance, created, **kwargs):
+    if created:
+        update_counters(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShopItem)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+def decrease_counters(sender, instance, **kwargs):
+    update_counters(sender, instance, -1)
+
+
+@receiver(post_save, sender=ShopItem)
+def add_to_shopping_list(sender, instance, created, using, **kwargs):
+    if created:
+        add_recipes(instance.user_id, [instance.recipe_id], using)
+
+
+# Runs after the delete so that, when a whole recipe goes through a
+# queryset delete, whichever of its cart rows and ingredient rows is
+# deleted second finds nothing left to subtract.
+@receiver(post_delete, sender=ShopItem)
+def remove_from_shopping_list(sender, instance, using, **kwargs):
+    if not is_batched(instance.recipe_id):
+        remove_recipes(instance.user_id, [instance.recipe_id], using)
+
+
+@receiver(pre_save, sender=IngredientAmount)
+def take_ingredient_from_carts(sender, instance, raw, using, **kwargs):
+    if raw or instance.pk is None:
+        return
+    previous = sender.objects.using(using).filter(pk=instance.pk).values(
+        'recipe_id', 'ingredient_id', 'amount').first()
+    if previous and not is_batched(previous['recipe_id']):
+        remove_ingredient_from_carts(using=using, **previous)
+
+
+@receiver(post_save, sender=IngredientAmount)
+def put_ingredient_into_carts(sender, instance, raw, using, **kwargs):
+    if not raw and not is_batched(instance.recipe_id):
+        add_ingredient_to_carts(instance.recipe_id, instance.ingredient_id,
+                                instance.amount, using)
+
+
+@receiver(post_delete, sender=IngredientAmount)
+def drop_ingredient_from_carts(sender, instance, using, **kwargs):
+    if not is_batched(instance.recipe_id):
+        remove_ingredient_from_carts(instance.recipe_id,
+                                     instance.ingredient_id, instance.amount,
+                                     using)
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShopItem)
+@receiver([post_save, post_delete], sender=Follow)
+def touch_relation_owner(sender, instance, created=True, **kwargs):
+    if created:
+        touch_owner(sender, getattr(instance, STAMPS[sender][0]))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def touch_recipe_author(sender, instance, **kwargs):
+    touch_users([instance.author_id], RECIPES)
+
+
+@receiver([post_save, post_delete], sender=IngredientAmount)
+def touch_ingredient_recipe(sender, instance, **kwargs):
+    # Batched writes save the recipe and touch the carts themselves.
+    if is_batched(instance.recipe_id):
+        return
+    recipes = Recipe.objects.filter(pk=instance.recipe_id)
+    touch_recipes(recipes)
+    touch_authors(recipes)
+    touch_carts(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_search(sender, instance, using, **kwargs):
+    remove_from_index([instance.pk], using)
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(sender, instance, created, using, **kwargs):
+    if not created:
+        update_index(IngredientAmount.objects.using(using).filter(
+            ingredient=instance).values_list('recipe', flat=True), using)
+
+
+def update_counters(sender, instance, delta):
+    if sender is Favorite:
+        change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                       'favorites_count', delta)
+    elif sender is ShopItem:
+        change_counter(Recipe.objects.filter(pk=instance.recipe_id),
+                       'shopping_cart_count', delta)
+    elif sender is Recipe:
+        change_counter(User.objects.filter(pk=instance.author_id),
+                       'recipes_count', delta)
+    elif sender is Follow:
+        change_counter(User.objects.filter(pk=instance.following_id),
+                       'followers_count', delta)
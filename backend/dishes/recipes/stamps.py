@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Subquery
+from django.utils import timezone
+
+from recipes.models import Favorite, Follow, Recipe, ShopItem
+
+User = get_user_model()
+
+RECIPES = 'recipes_changed_at'
+FAVORITES = 'favorites_changed_at'
+CART = 'cart_changed_at'
+FOLLOWS = 'follows_changed_at'
+VIEWER_STAMPS = (FAVORITES, CART, FOLLOWS)
+
+# model: (owner field, stamp bumped on the owner)
+STAMPS = {
+    Favorite: ('user_id', FAVORITES),
+    ShopItem: ('user_id', CART),
+    Follow: ('follower_id', FOLLOWS),
+}
+
+
+def touch(users, *fields):
+    now = timezone.now()
+    users.update(**{field: now for field in fields})
+
+
+def touch_users(user_ids, *fields):
+    touch(User.objects.filter(pk__in=user_ids), *fields)
+
+
+def touch_owner(model, owner_id):
+    touch_users([owner_id], STAMPS[model][1])
+
+
+def touch_carts(recipe_id):
+    touch(User.objects.filter(
+        pk__in=ShopItem.objects.filter(recipe_id=recipe_id).values('user_id')
+    ), CART)
+
+
+def touch_recipes(recipes):
+    recipes.update(updated_at=timezone.now())
+
+
+def touch_authors(recipes):
+    touch(User.objects.filter(pk__in=recipes.values('author_id')), RECIPES)
+
+
+def latest(field):
+    return Subquery(User.objects.order_by('-' + field).values(field)[:1])
+
+
+def get_stamps(user, fields=(), recipe_id=None, latest_fields=(RECIPES, )):
+    # Everything an ETag depends on in one query: the single recipe or the
+    # latest global stamps plus the viewer's own stamps.
+    if not user.is_authenticated:
+        fields = ()
+    if recipe_id is not None:
+        viewer = {'viewer_' + field: Subquery(User.objects.filter(
+            pk=user.pk).values(field)) for field in fields}
+        row = Recipe.objects.filter(pk=recipe_id).values(
+            'updated_at', 'author__' + RECIPES, **viewer).first()
+    else:
+        users = User.objects.all()
+        if user.is_authenticated:
+            users = users.filter(pk=user.pk)
+        row = users.values(*fields, **{
+            'latest_' + field: latest(field) for field in latest_fields
+        }).first()
+    return list(row.values()) if row else None
@@ -0,0 +1,182 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+
+from api.pagination import LimitPageNumberPagination
+from recipes.models import (Follow, Ingredient, IngredientAmount, Recipe,
+                            ShopItem)
+from recipes.relations import add_links, remove_links
+from recipes.shopping_lists import batch_ingredients, find_drift
+
+User = get_user_model()
+
+
+def create_user(name):
+    return User.objects.create(username=name, email=name + '@example.com',
+                               first_name=name, last_name=name)
+
+
+class HotPathIndexesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [create_user('author{0}'.format(number))
+                       for number in range(20)]
+        Recipe.objects.bulk_create([
+            Recipe(author=cls.authors[number % 20],
+                   name='Recipe {0}'.format(number),
+                   image='recipes/images/recipe.png', text='Text',
+                   cooking_time=5, favorites_count=number % 50)
+            for number in range(2000)], batch_size=500)
+        Follow.objects.bulk_create([
+            Follow(follower=follower, following=following)
+            for follower in cls.authors for following in cls.authors
+            if follower != following])
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            if connection.vendor == 'postgresql':
+                # The test tables are tiny; make the planner show which
+                # index it would pick instead of a sequential scan.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+
+    def test_feed(self):
+        self.assertUsesIndex(
+            Recipe.objects.with_viewer_flags(self.authors[1])[:10],
+            'recipe_pub_date_idx')
+
+    def test_keyset_page(self):
+        ordering = ('-pub_date', '-id')
+        last = Recipe.objects.order_by(*ordering)[100]
+        self.assertUsesIndex(
+            Recipe.objects.filter(LimitPageNumberPagination.after(
+                ordering, [last.pub_date, last.id])).order_by(*ordering)[:10],
+            'recipe_pub_date_idx')
+
+    def test_author(self):
+        self.assertUsesIndex(
+            Recipe.objects.filter(author=self.authors[3])[:10],
+            'recipe_author_pub_date_idx')
+
+    def test_popular(self):
+        self.assertUsesIndex(
+            Recipe.objects.order_by('-favorites_count', '-pub_date')[:10],
+            'recipe_popular_idx')
+
+    def test_followers(self):
+        self.assertUsesIndex(
+            Follow.objects.filter(following=self.authors[0]).values(
+                'follower'),
+            'follow_following_idx')
+
+
+class ShoppingListDriftTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user('user{0}'.format(number))
+                     for number in range(6)]
+        cls.ingredients = [
+            Ingredient.objects.create(name='Ingredient {0}'.format(number),
+                                      measurement_unit='g')
+            for number in range(8)]
+
+    def create_recipe(self, rng):
+        recipe = Recipe.objects.create(
+            author=rng.choice(self.users), name='Recipe', text='Text',
+            image='recipes/images/recipe.png', cooking_time=5)
+        for ingredient in rng.sample(self.ingredients, rng.randint(1, 4)):
+            IngredientAmount.objects.create(recipe=recipe,
+                                            ingredient=ingredient,
+                                            amount=rng.randint(1, 500))
+        return recipe
+
+    def test_incremental_lists_match_full_recompute(self):
+        rng = random.Random(2021)
+        recipes = [self.create_recipe(rng) for _ in range(6)]
+
+        def add_to_cart():
+            user, recipe = rng.choice(self.users), rng.choice(recipes)
+            if rng.random() < 0.5:
+                ShopItem.objects.get_or_create(user=user, recipe=recipe)
+            else:
+                add_links(ShopItem, user.pk, [recipe.pk])
+
+        def remove_from_cart():
+            item = ShopItem.objects.order_by('?').first()
+            if item is None:
+                return
+            if rng.random() < 0.5:
+                item.delete()
+            else:
+                remove_links(ShopItem, item.user_id, [item.recipe_id])
+
+        def change_amount():
+            amount = IngredientAmount.objects.order_by('?').first()
+            amount.amount = rng.randint(1, 500)
+            if rng.random() < 0.3:
+                taken = IngredientAmount.objects.filter(
+                    recipe=amount.recipe_id).values_list(
+                    'ingredient_id', flat=True)
+                free = [ingredient for ingredient in self.ingredients
+                        if ingredient.pk not in taken]
+                if free:
+                    amount.ingredient = rng.choice(free)
+            amount.save()
+
+        def add_ingredient():
+            recipe = rng.choice(recipes)
+            taken = set(recipe.ingredients.values_list(
+                'ingredient_id', flat=True))
+            free = [ingredient for ingredient in self.ingredients
+                    if ingredient.pk not in taken]
+            if free:
+                IngredientAmount.objects.create(
+                    recipe=recipe, ingredient=rng.choice(free),
+                    amount=rng.randint(1, 500))
+
+        def delete_ingredient():
+            amounts = IngredientAmount.objects.filter(
+                recipe=rng.choice(recipes))
+            if rng.random() < 0.5:
+                amount = amounts.order_by('?').first()
+                if amount is not None:
+                    amount.delete()
+            else:
+                amounts.filter(amount__lt=250).delete()
+
+        def rewrite_ingredients():
+            recipe = rng.choice(recipes)
+            with batch_ingredients(recipe.pk):
+                amounts = list(recipe.ingredients.all())
+                for amount in amounts:
+                    amount.amount = rng.randint(1, 500)
+                IngredientAmount.objects.bulk_update(amounts, ['amount'])
+                if amounts:
+                    amounts[0].delete()
+                taken = {amount.ingredient_id for amount in amounts}
+                IngredientAmount.objects.bulk_create([
+                    IngredientAmount(recipe=recipe, ingredient=ingredient,
+                                     amount=rng.randint(1, 500))
+                    for ingredient in self.ingredients
+                    if ingredient.pk not in taken][:2])
+
+        def replace_recipe():
+            recipes.pop(rng.randrange(len(recipes))).delete()
+            recipes.append(self.create_recipe(rng))
+
+        operations = [add_to_cart, add_to_cart, remove_from_cart,
+                      change_amount, add_ingredient, delete_ingredient,
+                      rewrite_ingredients, replace_recipe]
+        for step in range(300):
+            operation = rng.choice(operations)
+            operation()
+            self.assertEqual(
+                find_drift(), [],
+                'after step {0} ({1})'.format(step, operation.__name__))
+        self.assertTrue(ShopItem.objects.exists())
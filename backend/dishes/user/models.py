@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -9,3 +10,13 @@ class User(AbstractUser):
     email = models.EmailField(unique=True, blank=False)
     first_name = models.CharField(max_length=150, blank=False)
     last_name = models.CharField(max_length=150, blank=False)
+    recipes_count = models.PositiveIntegerField(default=0, editable=False)
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+    recipes_changed_at = models.DateTimeField(
+        default=timezone.now, editable=False, db_index=True)
+    favorites_changed_at = models.DateTimeField(
+        default=timezone.now, editable=False, db_index=True)
+    cart_changed_at = models.DateTimeField(
+        default=timezone.now, editable=False)
+    follows_changed_at = models.DateTimeField(
+        default=timezone.now, editable=False)